@@ -0,0 +1,170 @@
+from ops import *
+import argparse, json, os, sys, time
+
+"""micro-benchmark of the ops.py layers and blocks on cpu"""
+
+# name -> builder(x, channels), x is [bs, size, size, channels]
+OPS = {
+    'conv_zero': lambda x, c: conv(x, c, kernel=3, stride=1, pad=1, pad_type='zero'),
+    'conv_reflect': lambda x, c: conv(x, c, kernel=3, stride=1, pad=1, pad_type='reflect'),
+    'conv_sn': lambda x, c: conv(x, c, kernel=3, stride=1, pad=1, sn=True),
+    'conv_stride2': lambda x, c: conv(x, c, kernel=4, stride=2, pad=1),
+    'deconv': lambda x, c: deconv(x, c, kernel=4, stride=2),
+    'deconv_sn': lambda x, c: deconv(x, c, kernel=4, stride=2, sn=True),
+    'partial_conv': lambda x, c: partial_conv(x, c, kernel=3, stride=1),
+    'dilate_conv': lambda x, c: dilate_conv(x, c, kernel=3, rate=2),
+    'pixel_shuffle_up': lambda x, c: conv_pixel_shuffle_up(x),
+    'pixel_shuffle_down': lambda x, c: conv_pixel_shuffle_down(x),
+    'fully_connected': lambda x, c: fully_connected(x, c),
+
+    'resblock': lambda x, c: resblock(x, c),
+    'resblock_up': lambda x, c: resblock_up(x, c),
+    'resblock_down': lambda x, c: resblock_down(x, c),
+    'resblock_up_condition': lambda x, c: resblock_up_condition(x, tf.ones([x.shape[0], 16]), c),
+    'denseblock': lambda x, c: denseblock(x, c, n_db=4),
+    'res_denseblock': lambda x, c: res_denseblock(x, c, n_rdb=2, n_rdb_conv=3),
+    'self_attention': lambda x, c: self_attention(x, c),
+    'self_attention_blocked': lambda x, c: self_attention(x, c, block_size=256),
+    'self_attention_with_pooling': lambda x, c: self_attention_with_pooling(x, c),
+    'self_attention_with_pooling_blocked': lambda x, c: self_attention_with_pooling(x, c, block_size=256),
+    'squeeze_excitation': lambda x, c: squeeze_excitation(x, c, ratio=4),
+    'convolution_block_attention': lambda x, c: convolution_block_attention(x, c, ratio=4),
+    'global_context_block': lambda x, c: global_context_block(x, c),
+    'global_context_block_blocked': lambda x, c: global_context_block(x, c, block_size=256),
+    'srm_block': lambda x, c: srm_block(x, c),
+
+    'batch_norm': lambda x, c: batch_norm(x, is_training=True),
+    'instance_norm': lambda x, c: instance_norm(x),
+    'layer_norm': lambda x, c: layer_norm(x),
+    'group_norm': lambda x, c: group_norm(x, groups=min(32, c)),
+    'condition_batch_norm': lambda x, c: condition_batch_norm(x, tf.ones([x.shape[0], 16])),
+    'batch_instance_norm': lambda x, c: batch_instance_norm(x),
+    'switch_norm': lambda x, c: switch_norm(x),
+    'adaptive_instance_norm': lambda x, c: adaptive_instance_norm(x, tf.ones([1, 1, 1, c]), tf.zeros([1, 1, 1, c])),
+    'pixel_norm': lambda x, c: pixel_norm(x),
+
+    'lrelu': lambda x, c: lrelu(x),
+    'swish': lambda x, c: swish(x),
+    'up_sample': lambda x, c: up_sample(x),
+    'max_pooling': lambda x, c: max_pooling(x),
+    'avg_pooling': lambda x, c: avg_pooling(x),
+}
+
+def parse_args():
+    desc = "Benchmark of the ops.py layers, forward and forward+backward on cpu"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--ops', type=str, default='', help='Comma separated op names, empty runs all')
+    parser.add_argument('--batch', type=str, default='8', help='Comma separated batch sizes')
+    parser.add_argument('--size', type=str, default='16,32', help='Comma separated spatial sizes')
+    parser.add_argument('--channels', type=str, default='32,64', help='Comma separated channel numbers')
+
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed runs before measuring')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per op and config')
+    parser.add_argument('--threads', type=int, default=0, help='intra op threads, 0 lets tensorflow decide')
+
+    parser.add_argument('--output', type=str, default='bench_ops.json', help='Result json')
+    parser.add_argument('--baseline', type=str, default='', help='Baseline json to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative median slowdown reported as a regression')
+
+    return parser.parse_args()
+
+def int_list(x):
+    return [int(v) for v in x.split(',') if v.strip()]
+
+def time_op(sess, op, warmup, repeat):
+    for _ in range(warmup):
+        sess.run(op)
+
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        sess.run(op)
+        times.append((time.time() - start) * 1000.0)
+
+    return {'median_ms': float(np.median(times)), 'p95_ms': float(np.percentile(times, 95))}
+
+def benchmark(name, batch, size, channels, args):
+    with tf.Graph().as_default():
+        with tf.device('/cpu:0'):
+            x = tf.Variable(tf.random_normal([batch, size, size, channels]), name='x')
+
+            with tf.variable_scope(name):
+                y = OPS[name](x, channels)
+
+            forward = tf.group(y)
+
+            # gradients for the input and every variable the op created
+            params = [x] + tf.trainable_variables(name)
+            grads = [g for g in tf.gradients(tf.reduce_sum(y), params) if g is not None]
+            backward = tf.group(y, *grads)
+
+        config = tf.ConfigProto(device_count={'GPU': 0}, intra_op_parallelism_threads=args.threads)
+        with tf.Session(config=config) as sess:
+            sess.run(tf.global_variables_initializer())
+
+            return {'forward': time_op(sess, forward, args.warmup, args.repeat),
+                    'forward_backward': time_op(sess, backward, args.warmup, args.repeat)}
+
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    for key, value in sorted(results.items()):
+        if key not in baseline :
+            continue
+
+        for mode in ['forward', 'forward_backward']:
+            ratio = value[mode]['median_ms'] / max(baseline[key][mode]['median_ms'], 1e-9)
+            value[mode]['baseline_ratio'] = ratio
+
+            if ratio > 1.0 + tolerance :
+                regressions.append((key, mode, ratio))
+
+    return regressions
+
+def main():
+    args = parse_args()
+
+    names = [name.strip() for name in args.ops.split(',') if name.strip()] or sorted(OPS.keys())
+    results = {}
+    failures = []
+
+    for name in names:
+        for batch in int_list(args.batch):
+            for size in int_list(args.size):
+                for channels in int_list(args.channels):
+                    key = '{}/b{}_s{}_c{}'.format(name, batch, size, channels)
+                    try:
+                        results[key] = benchmark(name, batch, size, channels, args)
+                    except Exception as e:
+                        print(" [!] {} failed : {}".format(key, e))
+                        failures.append(key)
+                        continue
+
+                    print("{:<48s} fwd {:9.3f} ms (p95 {:9.3f})   fwd+bwd {:9.3f} ms (p95 {:9.3f})".format(
+                        key, results[key]['forward']['median_ms'], results[key]['forward']['p95_ms'],
+                        results[key]['forward_backward']['median_ms'], results[key]['forward_backward']['p95_ms']))
+
+    if args.baseline and os.path.exists(args.baseline) :
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+
+        print()
+        print("##### Baseline {} #####".format(args.baseline))
+        for key, mode, ratio in regressions:
+            print("# REGRESSION {:<48s} {:<16s} x{:.2f}".format(key, mode, ratio))
+        print("# {} regressions over {:.0f}%".format(len(regressions), args.tolerance * 100))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    print(" [*] Write {}".format(args.output))
+
+    if failures :
+        # failed configs are missing from the json, the run does not count as a measurement
+        sys.exit(" [!] {} configs failed : {}".format(len(failures), ', '.join(failures)))
+
+
+if __name__ == '__main__':
+    main()
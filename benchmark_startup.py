@@ -0,0 +1,72 @@
+import argparse, json, os, subprocess, sys, time
+
+"""cli startup time of main.py : argument handling alone and the imports of a real phase"""
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (command run from the repository root, expected exit code), argparse exits with 2 on a bad flag
+COMMANDS = {
+    'help': ([sys.executable, 'main.py', '--help'], 0),
+    'bad_flag': ([sys.executable, 'main.py', '--no_such_flag'], 2),
+    'import_main': ([sys.executable, '-c', 'import main'], 0),
+    'import_networks': ([sys.executable, '-c', 'import networks'], 0),
+    'import_tensorflow': ([sys.executable, '-c', 'import tensorflow'], 0),
+}
+
+def parse_args():
+    desc = "Startup time of main.py, --help and bad flags against the imports of a training phase"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--commands', type=str, default='', help='Comma separated command names, empty runs all')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per command')
+
+    parser.add_argument('--output', type=str, default='bench_startup.json', help='Result json')
+    parser.add_argument('--baseline', type=str, default='', help='Baseline json to compare against, e.g. from the previous commit')
+
+    return parser.parse_args()
+
+def time_command(command, returncode, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        result = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        times.append((time.time() - start) * 1000.0)
+
+        # a command that fails early, e.g. on a missing import, would time nothing useful
+        if result.returncode != returncode :
+            sys.exit(" [!] {} exited with {}, expected {}\n{}".format(
+                ' '.join(command), result.returncode, returncode, result.stderr.decode(errors='replace')))
+
+    times = sorted(times)
+
+    return {'median_ms': times[len(times) // 2], 'min_ms': times[0]}
+
+def main():
+    args = parse_args()
+
+    names = [name.strip() for name in args.commands.split(',') if name.strip()] or list(COMMANDS.keys())
+    results = {}
+
+    for name in names:
+        results[name] = time_command(*COMMANDS[name], repeat=args.repeat)
+        print("{:<24s} {:9.1f} ms (min {:9.1f})".format(name, results[name]['median_ms'], results[name]['min_ms']))
+
+    if args.baseline and os.path.exists(args.baseline) :
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        print()
+        print("##### Baseline {} #####".format(args.baseline))
+        for name in names:
+            if name in baseline :
+                print("# {:<24s} {:9.1f} ms -> {:9.1f} ms (x{:.1f})".format(
+                    name, baseline[name]['median_ms'], results[name]['median_ms'],
+                    baseline[name]['median_ms'] / max(results[name]['median_ms'], 1e-9)))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    print(" [*] Write {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+from main import parse_args
+from networks import DCGAN
+from utils import *
+import argparse, json, time
+
+"""end-to-end training throughput on synthetic in-memory batches"""
+
+def parse_bench_args():
+    desc = "DCGAN training throughput sweep with synthetic data"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--gan_type', type=str, default='gan,lsgan,hinge,wgan-gp', help='Comma separated gan types')
+    parser.add_argument('--batch_size', type=str, default='16,64', help='Comma separated batch sizes')
+    parser.add_argument('--ch', type=str, default='64', help='Comma separated base channel numbers')
+    parser.add_argument('--img_size', type=str, default='64', help='Comma separated image sizes')
+
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed training steps')
+    parser.add_argument('--steps', type=int, default=50, help='Timed training steps')
+
+    parser.add_argument('--extra', type=str, default='', help='Extra main.py flags for every run, e.g. "--precision float16"')
+    parser.add_argument('--work_dir', type=str, default='bench', help='Directory for the per-run checkpoint/log/sample folders')
+    parser.add_argument('--output', type=str, default='bench_train.json', help='Result json')
+
+    return parser.parse_args()
+
+def run_steps(sess, gan, steps):
+    # --loop_steps in --extra : whole in-graph loops, steps rounded up to a multiple of loop_steps
+    if gan.loop_steps > 0 :
+        for _ in range(-(-steps // gan.loop_steps)):
+            sess.run(gan.loop_optim)
+        return -(-steps // gan.loop_steps) * gan.loop_steps
+
+    for _ in range(steps):
+        for _ in range(gan.n_critic):
+            sess.run(gan.d_step)
+        sess.run(gan.g_optim)
+
+    return steps
+
+def benchmark(gan_type, batch_size, ch, img_size, bench_args):
+    work_dir = bench_args.work_dir
+    args = parse_args(['--phase', 'train', '--synthetic', 'True', '--gan_type', gan_type,
+                       '--batch_size', str(batch_size), '--ch', str(ch), '--img_size', str(img_size),
+                       '--checkpoint_dir', os.path.join(work_dir, 'checkpoint'), '--result_dir', os.path.join(work_dir, 'results'),
+                       '--log_dir', os.path.join(work_dir, 'logs'), '--sample_dir', os.path.join(work_dir, 'samples')]
+                      + bench_args.extra.split())
+
+    tf.reset_default_graph()
+    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+        gan = DCGAN(sess, args)
+        gan.build_model()
+
+        tf.global_variables_initializer().run()
+        tf.local_variables_initializer().run()
+        sess.run(gan.stage_inputs)
+
+        # warm-up : graph optimization, allocator growth, autotuning
+        run_steps(sess, gan, bench_args.warmup)
+
+        start = time.time()
+        steps = run_steps(sess, gan, bench_args.steps)
+        elapsed = time.time() - start
+
+        gan.image_writer.close()
+
+    steps_per_sec = steps / elapsed
+
+    return {'gan_type': gan_type, 'batch_size': batch_size, 'ch': ch, 'img_size': img_size,
+            'steps_per_sec': steps_per_sec, 'images_per_sec': steps_per_sec * batch_size,
+            'step_ms': 1000.0 / steps_per_sec}
+
+def main():
+    bench_args = parse_bench_args()
+
+    def values(x, cast=int):
+        return [cast(v) for v in x.split(',') if v.strip()]
+
+    results = []
+    for gan_type in values(bench_args.gan_type, str):
+        for batch_size in values(bench_args.batch_size):
+            for ch in values(bench_args.ch):
+                for img_size in values(bench_args.img_size):
+                    # a failing config stops the sweep, nothing is written for a partial run
+                    result = benchmark(gan_type, batch_size, ch, img_size, bench_args)
+                    results.append(result)
+
+                    print("# {:<10s} bs {:4d} ch {:4d} size {:4d} : {:8.2f} steps/sec {:10.1f} images/sec".format(
+                        gan_type, batch_size, ch, img_size, result['steps_per_sec'], result['images_per_sec']))
+
+    with open(bench_args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(" [*] Write {}".format(bench_args.output))
+
+
+if __name__ == '__main__':
+    main()
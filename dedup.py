@@ -0,0 +1,37 @@
+from utils import *
+import argparse
+
+"""near-duplicate removal with perceptual hashes, writes a filtered manifest for --manifest_path"""
+
+def parse_args():
+    desc = "Perceptual-hash deduplication of ./dataset/<dataset>"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--dataset', type=str, default='human_faces', help='dataset_name')
+    parser.add_argument('--img_ch', type=int, default=3, help='The number of image channels of the manifest')
+    parser.add_argument('--threshold', type=int, default=4, help='Hamming distance of 64 bit hashes counted as a duplicate')
+    parser.add_argument('--workers', type=int, default=0, help='Hashing processes, 0 uses every core')
+    parser.add_argument('--output', type=str, default='', help='Filtered manifest, default ./dataset/<dataset>_dedup_manifest.json')
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    try:
+        assert 0 <= args.threshold < 64
+    except:
+        print('threshold must be between zero and 63')
+        return
+
+    manifest = load_manifest(args.dataset, args.img_ch, num_workers=args.workers)
+    manifest = dedup_manifest(manifest, threshold=args.threshold, num_workers=args.workers)
+
+    output = args.output or os.path.join('./dataset', args.dataset + '_dedup_manifest.json')
+    with open(output, 'w') as f:
+        json.dump(manifest, f)
+
+    print(" [*] Write {}, train with --manifest_path {}".format(output, output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,43 @@
-from networks import networks
-import argparse
-from utils import *
+import argparse, os
+
+# tensorflow, tf.contrib and cv2 are imported by main() once the arguments are valid, --help and bad flags return at once
 
 """parsing and configuration"""
 
-def parse_args():
+def str2bool(x):
+    # utils.str2bool, without importing tensorflow through utils
+    return x.lower() in ('true')
+
+def check_folder(log_dir):
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return log_dir
+
+def parse_args(argv=None):
     desc = "Tensorflow implementation DCGAN"
     parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument('--phase', type=str, default='train', help='train or test ?')
+    parser.add_argument('--phase', type=str, default='train', help='train, test or export ?')
     parser.add_argument('--dataset', type=str, default='human_faces', help='[anime_faces / simpsons_faces / custom_dataset]')
 
     parser.add_argument('--epoch', type=int, default=30, help='The number of epochs to run')
     parser.add_argument('--iteration', type=int, default=10000, help='The number of training iterations')
     parser.add_argument('--batch_size', type=int, default=100, help='The size of batch per gpu')
+    parser.add_argument('--data_parallel', type=str2bool, default=False, help='Average gradients over horovodrun replicas')
     parser.add_argument('--ch', type=int, default=256, help='base channel number per layer')
 
     parser.add_argument('--print_freq', type=int, default=1000, help='The number of image_print_freqy')
     parser.add_argument('--save_freq', type=int, default=10000, help='The number of ckpt_save_freq')
+    parser.add_argument('--trace_steps', type=str, default='', help='Steps to trace as chrome json in log_dir, e.g. 100-102,500')
+    parser.add_argument('--g_save_freq', type=int, default=1000, help='The number of generator-only ckpt_save_freq, 0 disables')
+    parser.add_argument('--keep_last', type=int, default=5, help='Keep the last K checkpoints, 0 keeps all')
+    parser.add_argument('--keep_every', type=int, default=0, help='Also keep every checkpoint whose step is a multiple of N')
+
+    parser.add_argument('--n_critic', type=int, default=1, help='D updates per G update')
+    parser.add_argument('--loop_steps', type=int, default=0, help='G steps (each after n_critic D steps) run in one in-graph loop per session run, 0 runs every update separately')
+
+    parser.add_argument('--ld', type=float, default=10.0, help='The gradient penalty lambda for gp / lp / dragan losses')
+    parser.add_argument('--r1_gamma', type=float, default=0.0, help='R1 penalty weight on real images, 0 disables')
+    parser.add_argument('--reg_every', type=int, default=1, help='Evaluate the gradient penalties every k iterations as a separate update, 1 adds them to every D step')
 
     parser.add_argument('--g_lr', type=float, default=0.0001, help='learning rate for generator')
     parser.add_argument('--d_lr', type=float, default=0.0001, help='learning rate for discriminator')
@@ -26,13 +47,44 @@ def parse_args():
     parser.add_argument('--beta2', type=float, default=0.9, help='beta2 for Adam optimizer')
 
     parser.add_argument('--z_dim', type=int, default=128, help='Dimension of noise vector')
+    parser.add_argument('--sn', type=str2bool, default=False, help='using spectral norm in the discriminator')
+    parser.add_argument('--joint_d', type=str2bool, default=False, help='one discriminator pass over real and fake, batch norm per half')
+    # tensorflow 1.x registers no bfloat16 conv kernels on gpu or cpu, an unknown value exits with status 2
+    parser.add_argument('--precision', type=str, default='float32', choices=['float32', 'float16'],
+                        help='[float32 / float16] compute dtype, weights stay float32')
 
     parser.add_argument('--gan_type', type=str, default='gan', help='dcgan')
     
     parser.add_argument('--img_size', type=int, default=64, help='The size of image')
+    parser.add_argument('--img_ch', type=int, default=3, help='The number of image channels')
     parser.add_argument('--sample_num', type=int, default=64, help='The number of sample images')
 
     parser.add_argument('--test_num', type=int, default=10, help='The number of images generated by the test')
+    parser.add_argument('--export_path', type=str, default='', help='Path of the frozen generator .pb written by the export phase')
+
+    parser.add_argument('--writer_threads', type=int, default=2, help='Background threads writing sample images')
+    parser.add_argument('--writer_queue', type=int, default=8, help='Sample grids queued before the training step waits')
+
+    parser.add_argument('--device', type=str, default='auto', help='Input prefetch device [auto / /gpu:0 / /cpu:0]')
+    parser.add_argument('--num_parallel_calls', type=int, default=0, help='Parallel input map calls, 0 picks from the core count')
+    parser.add_argument('--prefetch_mb', type=int, default=256, help='Memory budget (MB) for prefetched input batches')
+
+    parser.add_argument('--augment_on', type=str, default='batch', help='[image / batch / device] per image in the map, vectorized per batch in the pipeline, or on the compute device')
+
+    parser.add_argument('--scaled_decode', type=str2bool, default=False, help='Decode jpegs at 1/2, 1/4 or 1/8 scale before the resize, reports the psnr against full decode')
+
+    parser.add_argument('--synthetic', type=str2bool, default=False, help='Train on random in-memory batches instead of the dataset')
+
+    parser.add_argument('--manifest', type=str2bool, default=True, help='Read image paths from the validated dataset manifest instead of listing the directory')
+    parser.add_argument('--update_manifest', type=str2bool, default=False, help='Validate new or modified images and update the manifest')
+    parser.add_argument('--manifest_path', type=str, default='', help='Train on the images of this manifest, e.g. the output of dedup.py')
+
+    parser.add_argument('--shards', type=str2bool, default=False, help='Read the TFRecord shards written by make_shards.py instead of the image files')
+    parser.add_argument('--shard_dir', type=str, default='shards', help='Directory of the dataset shards')
+    parser.add_argument('--shard_buffer', type=int, default=10000, help='Records in the shuffle buffer when reading shards')
+    parser.add_argument('--shard_cycle', type=int, default=8, help='Shards read in parallel')
+
+    parser.add_argument('--cache', type=str2bool, default=False, help='Decode the dataset once into a memory-mapped uint8 cache')
 
     parser.add_argument('--checkpoint_dir', type=str, default='checkpoint',
                         help='Directory name to save the checkpoints')
@@ -42,8 +94,10 @@ def parse_args():
                         help='Directory name to save training logs')
     parser.add_argument('--sample_dir', type=str, default='samples',
                         help='Directory name to save the samples on training')
+    parser.add_argument('--cache_dir', type=str, default='cache',
+                        help='Directory name to save the decoded image cache')
 
-    return check_args(parser.parse_args())
+    return check_args(parser.parse_args(argv))
 
 """checking arguments"""
 def check_args(args):
@@ -59,20 +113,78 @@ def check_args(args):
     # --sample_dir
     check_folder(args.sample_dir)
 
+    # --cache_dir
+    if args.cache :
+        check_folder(args.cache_dir)
+
     # --epoch
     try:
         assert args.epoch >= 1
     except:
         print('number of epochs must be larger than or equal to one')
 
+    # --img_size
+    try:
+        assert args.img_size >= 8 and args.img_size & (args.img_size - 1) == 0
+    except:
+        print('image size must be a power of two, at least 8')
+
     # --batch_size
     try:
         assert args.batch_size >= 1
     except:
         print('batch size must be larger than or equal to one')
+
+    # --n_critic
+    try:
+        assert args.n_critic >= 1
+    except:
+        print('number of critic steps must be larger than or equal to one')
+
+    # --loop_steps
+    try:
+        assert args.loop_steps >= 0
+    except:
+        print('loop steps must be larger than or equal to zero')
+
+    # --reg_every
+    try:
+        assert args.reg_every >= 1
+    except:
+        print('regularization interval must be larger than or equal to one')
+
+    # --augment_on
+    try:
+        assert args.augment_on in ['image', 'batch', 'device']
+    except:
+        print('augment_on must be one of image, batch, device')
+
+    # --shard_buffer
+    try:
+        assert args.shard_buffer >= 1 and args.shard_cycle >= 1
+    except:
+        print('shard buffer and cycle must be larger than or equal to one')
+
+    # --prefetch_mb
+    try:
+        assert args.prefetch_mb >= 1
+    except:
+        print('prefetch memory budget must be larger than or equal to one MB')
     return args
 
 
+def prepare_dataset(args):
+    """ Manifest validation (a forked process pool) and image cache build, run by the chief before any session exists """
+    from utils import dataset_paths, image_cache_path, load_image_cache
+
+    if args.phase != 'train' or args.synthetic or args.shards :
+        return
+
+    data = dataset_paths(args.dataset, args.img_ch, use_manifest=args.manifest, path=args.manifest_path, update=args.update_manifest)
+
+    if args.cache :
+        load_image_cache(data, image_cache_path(args.cache_dir, args.dataset, args.img_size, args.img_ch), args.img_size, args.img_ch)
+
 """main"""
 def main():
     # parse arguments
@@ -80,10 +192,29 @@ def main():
     if args is None:
       exit()
 
+    import tensorflow as tf
+    from networks import DCGAN
+    from utils import init_data_parallel, data_parallel_barrier, data_parallel_session_config, show_all_variables, show_memory_report
+
+    config = tf.ConfigProto(allow_soft_placement=True)
+
+    # data parallel : one process per replica, launched with horovodrun -np N
+    hvd = None
+    if args.data_parallel :
+        hvd = init_data_parallel()
+        config = data_parallel_session_config(config, hvd, args.device)
+
+    # the other replicas wait until the chief has written the dataset files they read
+    if hvd is None or hvd.rank() == 0 :
+        prepare_dataset(args)
+
+    if hvd :
+        data_parallel_barrier(hvd)
+
     # open session
-    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+    with tf.Session(config=config) as sess:
 
-        gan = DCGAN(sess, args)
+        gan = DCGAN(sess, args, hvd=hvd)
 
         # build graph
         gan.build_model()
@@ -91,6 +222,9 @@ def main():
         # show network architecture
         show_all_variables()
 
+        # per-scope activation / parameter / optimizer-slot memory
+        show_memory_report(os.path.join(check_folder(os.path.join(args.log_dir, gan.model_dir)), 'memory_{}.json'.format(args.phase)))
+
         if args.phase == 'train' :
             # launch the graph in a session
             gan.train()
@@ -103,6 +237,14 @@ def main():
         if args.phase == 'test' :
             gan.test()
             print(" [*] Test finished!")
+
+        if args.phase == 'export' :
+            gan.export()
+            print(" [*] Export finished!")
+
+        # wait for queued sample images
+        gan.image_writer.close()
     
     
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+from utils import *
+import argparse
+
+"""pack a dataset directory into TFRecord shards for --shards True"""
+
+def parse_args():
+    desc = "Write ./dataset/<dataset>/*.* into large sequential TFRecord shards"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--dataset', type=str, default='human_faces', help='dataset_name')
+    parser.add_argument('--img_ch', type=int, default=3, help='The number of image channels of the manifest')
+    parser.add_argument('--shard_dir', type=str, default='shards', help='Directory of the dataset shards')
+    parser.add_argument('--shard_mb', type=int, default=256, help='Approximate size of one shard in MB')
+    parser.add_argument('--compression', type=str, default='', help='[ / GZIP / ZLIB] record compression, encoded jpegs gain little')
+
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.compression not in compression_types :
+        print(" [!] compression must be one of '', GZIP, ZLIB")
+        return
+
+    # validated paths when the dataset has a manifest
+    if os.path.exists(manifest_path(args.dataset)) :
+        data = [entry['path'] for entry in load_manifest(args.dataset, args.img_ch)['images']]
+    else :
+        data = sorted(load_data(args.dataset))
+    if not data :
+        print(" [!] No images in ./dataset/{}".format(args.dataset))
+        return
+
+    write_shards(data, args.shard_dir, args.dataset, shard_mb=args.shard_mb, compression=args.compression)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,19 @@ from ops import *
 from utils import *
 from glob import glob
 import time
-from tensorflow.contrib.data import prefetch_to_device, shuffle_and_repeat, map_and_batch
 import numpy as np
 
 class DCGAN(object):
-    def __init__(self, sess, args):
+    def __init__(self, sess, args, hvd=None):
         self.sess = sess
         self.phase = args.phase
+
+        # horovod module for --data_parallel, None for a single replica
+        self.hvd = hvd
+        self.num_replicas = hvd.size() if hvd else 1
+        self.rank = hvd.rank() if hvd else 0
+        self.local_replicas = hvd.local_size() if hvd else 1
+        self.is_chief = self.rank == 0
         
         self.checkpoint_dir = args.checkpoint_dir
         self.result_dir = args.result_dir
@@ -20,27 +26,82 @@ class DCGAN(object):
         
         self.g_lr = args.g_lr
         self.d_lr = args.d_lr
-
+        self.beta1 = args.beta1
+        self.beta2 = args.beta2
         
         self.batch_size = args.batch_size
         self.print_freq = args.print_freq
         self.save_freq = args.save_freq        
+        self.g_save_freq = args.g_save_freq
+        self.trace_steps = parse_steps(args.trace_steps)
+        self.keep_last = args.keep_last
+        self.keep_every = args.keep_every
         
         self.img_size = args.img_size
         self.img_ch = args.img_ch
+        self.sample_num = args.sample_num
         
         self.ch = args.ch
+        self.sn = args.sn
+        self.joint_d = args.joint_d
+
+        # n_critic D updates per G update, loop_steps > 0 runs that many G steps inside one graph loop per sess.run
+        self.n_critic = args.n_critic
+        self.loop_steps = args.loop_steps
+
+        # gradient penalties : ld for gp / lp / dragan losses, r1_gamma for the R1 penalty of simple_gp
+        # reg_every > 1 evaluates them lazily every reg_every iterations with their own update, scaled to the same strength
+        self.ld = args.ld
+        self.r1_gamma = args.r1_gamma
+        self.reg_every = args.reg_every
+
+        # activations in float16, master weights and batch norm statistics in float32
+        self.precision = args.precision
+        set_precision(self.precision)
         
         self.gan_type = args.gan_type
         self.z_dim = args.z_dim
+        self.model_name = "DCGAN"
         
-        self.c_dim = 3
-        self.data = load_data(dataset_name=self.dataset_name)
+        self.c_dim = self.img_ch
+        self.test_num = args.test_num
+        self.export_path = args.export_path
+
+        # the test phase only runs the generator, so it never scans the dataset
+        self.synthetic = args.synthetic
+
+        # sharded archive from make_shards.py : the dataset directory is never listed
+        self.shards = args.shards
+        self.shard_dir = args.shard_dir
+        self.shard_buffer = args.shard_buffer
+        self.shard_cycle = args.shard_cycle
+        self.shard_meta = load_shards(self.shard_dir, self.dataset_name) if self.phase == 'train' and self.shards and not self.synthetic else None
+
+        # validated manifest instead of a directory walk, only read here : main.py builds or updates it before the session opens
+        self.data = []
+        if self.phase == 'train' and not self.synthetic and not self.shards :
+            self.data = dataset_paths(self.dataset_name, self.img_ch, use_manifest=args.manifest, path=args.manifest_path, build=False)
         self.custom_dataset = True
 
-        self.dataset_num = len(self.data)
+        self.cache = args.cache
+        self.cache_dir = args.cache_dir
+
+        # where augmentation runs : per image in the map function, per batch in the input pipeline or on the compute device
+        self.augment_on = args.augment_on
+
+        # jpegs downscaled inside the decoder when the sources are much larger than img_size
+        self.scaled_decode = args.scaled_decode
+
+        self.device = args.device
+        self.num_parallel_calls = args.num_parallel_calls
+        self.prefetch_mb = args.prefetch_mb
+
+        self.dataset_num = self.shard_meta['num_images'] if self.shard_meta else len(self.data)
+
+        # sample pngs are encoded off the training thread
+        self.image_writer = ImageWriter(num_workers=args.writer_threads, max_queue=args.writer_queue)
         
-        self.sample_dir = os.path.join(self.sample_dir, self.model_dir)
+        self.sample_dir = os.path.join(args.sample_dir, self.model_dir)
         check_folder(self.sample_dir)
         
         print()
@@ -49,63 +110,96 @@ class DCGAN(object):
         print("# dataset : ", self.dataset_name)
         print("# dataset number : ", self.dataset_num)
         print("# batch_size : ", self.batch_size)
+        print("# replicas : {} (rank {}, global batch_size {})".format(self.num_replicas, self.rank, self.batch_size * self.num_replicas))
         print("# epoch : ", self.epoch)
         print("# iteration per epoch : ", self.iteration)
+        print("# critic steps : ", self.n_critic)
+        print("# in-graph loop steps : ", self.loop_steps)
+        print("# regularization every : ", self.reg_every)
+        print("# image cache : ", self.cache)
+        print("# shards : ", len(self.shard_meta['shards']) if self.shard_meta else None)
+        print("# augmentation : ", self.augment_on)
 
         print("##### Generator #####")
-        print("# learning rate : ", self.g_learning_rate)
+        print("# learning rate : ", self.g_lr)
 
         print()
 
         print("##### Discriminator #####")
-        print("# learning rate : ", self.d_learning_rate)
+        print("# learning rate : ", self.d_lr)
+        print("# spectral norm : ", self.sn)
+        print("# joint real/fake pass : ", self.joint_d)
             
-    def gernertaor(self, x_init, reuse=False, scope="gernerator"):
+    def generator(self, x_init, is_training=True, reuse=False, dtype=None, scope="generator"):
         channel = self.ch
-        with tf.variable_scope(scope, reuse=reuse):
-            x= conv(x_init,channel*2,kernel=2,stride=1,pad=3,scope="conv1")
-            x= batch_norm(x)
-            x= relu(x)
-            
-            x= conv(x,channel*2,kernel=2,stride=2,pad=3,scope="conv2")
-            x= batch_norm(x)
-            x= relu(x)
-            
-            x= conv(x,channel//2,kernel=2,stride=2,pad=3,scope="conv3")
-            x= batch_norm(x)
-            x= relu(x)
+        dtype = dtype or precision_policy['compute_dtype']
+        with tf.variable_scope(scope, reuse=reuse, custom_getter=float32_variable_getter):
+            x= tf.cast(x_init, dtype)
 
-            x= conv(x,channel//2,kernel=2,stride=2,pad=3,scope="conv4")
-            x= batch_norm(x)
+            # z [bs, 1, 1, z_dim] -> [bs, 4, 4, ch]
+            x= fully_connected(x,4*4*channel,scope="fc")
+            x= tf.reshape(x,[-1,4,4,channel])
+            x= batch_norm(x, is_training, scope="batch_norm0")
             x= relu(x)
-            
-            return x
+
+            # x2 per block up to img_size / 2, channels halved
+            for i in range(int(np.log2(self.img_size)) - 3):
+                channel = max(channel // 2, 1)
+                x= deconv(x,channel,kernel=4,stride=2,scope="deconv"+str(i+1))
+                x= batch_norm(x, is_training, scope="batch_norm"+str(i+1))
+                x= relu(x)
+
+            # [bs, img_size, img_size, img_ch] in [-1, 1]
+            x= deconv(x,self.img_ch,kernel=4,stride=2,scope="deconv_out")
+            x= tanh(x)
+
+            return tf.cast(x, tf.float32)
             
         
         
-    def discriminator(self, x_init, reuse=False, scope="discriminator"):
+    def discriminator(self, x_init, is_training=True, reuse=False, dtype=None, num_splits=1, scope="discriminator"):
         channel = self.ch
-        with tf.variable_scope(scope, reuse=reuse):
-            x= conv(x_init,channel*2,kernel=2,stride=1,pad=3,scope="conv1")
-            x= batch_norm(x)
+        dtype = dtype or precision_policy['compute_dtype']
+        with tf.variable_scope(scope, reuse=reuse, custom_getter=float32_variable_getter):
+            x= tf.cast(x_init, dtype)
+
+            # num_splits > 1 : x is several batches concatenated, each normalized with its own statistics
+            if num_splits > 1 :
+                norm = lambda x, is_training, scope: split_batch_norm(x, is_training, num_splits, scope=scope)
+            else :
+                norm = batch_norm
+
+            x= conv(x,channel*2,kernel=2,stride=1,pad=3,sn=self.sn,scope="conv1")
+            x= norm(x, is_training, scope="batch_norm1")
             x= relu(x)
             
-            x= conv(x,channel*2,kernel=2,stride=2,pad=3,scope="conv2")
-            x= batch_norm(x)
+            x= conv(x,channel*2,kernel=2,stride=2,pad=3,sn=self.sn,scope="conv2")
+            x= norm(x, is_training, scope="batch_norm2")
             x= relu(x)
             
-            x= conv(x,channel//2,kernel=2,stride=2,pad=3,scope="conv3")
-            x= batch_norm(x)
+            x= conv(x,channel//2,kernel=2,stride=2,pad=3,sn=self.sn,scope="conv3")
+            x= norm(x, is_training, scope="batch_norm3")
             x= relu(x)
 
-            x= conv(x,channel//2,kernel=2,stride=2,pad=3,scope="conv4")
-            x= batch_norm(x)
+            x= conv(x,channel//2,kernel=2,stride=2,pad=3,sn=self.sn,scope="conv4")
+            x= norm(x, is_training, scope="batch_norm4")
             x= relu(x)
             
             x= flatten(x)
-            x= fully_connected(x,channel)
+            x= fully_connected(x,1,sn=self.sn)
             
-            return x
+            return tf.cast(x, tf.float32)
+
+    def discriminate(self, real, fake, reuse=False, dtype=None):
+        if self.joint_d :
+            # one pass over [real; fake] : half the kernel launches, spectral norm and its u update run once
+            logits = self.discriminator(tf.concat([real, fake], axis=0), reuse=reuse, dtype=dtype, num_splits=2)
+            real_logits, fake_logits = tf.split(logits, num_or_size_splits=2, axis=0)
+        else :
+            real_logits = self.discriminator(real, reuse=reuse, dtype=dtype)
+            fake_logits = self.discriminator(fake, reuse=True, dtype=dtype)
+
+        return real_logits, fake_logits
         
         
     def loss():
@@ -113,68 +207,496 @@ class DCGAN(object):
             
         
     def build_model(self):
+        if self.phase in ['test', 'export'] :
+            return self.build_test_model()
+
         """ Graph Input """
         # images
-        Image_Data_Class = ImageData(self.img_size, self.c_dim, self.custom_dataset)
-        inputs = tf.data.Dataset.from_tensor_slices(self.data)
-        
-        gpu_device = '/gpu:0'
-        inputs = inputs.\
-            apply(shuffle_and_repeat(self.dataset_num)).\
-            apply(map_and_batch(Image_Data_Class.image_processing, self.batch_size, num_parallel_batches=16, drop_remainder=True)).\
-            apply(prefetch_to_device(gpu_device, self.batch_size))
-        
+        pipeline_config = input_pipeline_config(self.batch_size, self.img_size, self.c_dim, device=self.device,
+                                                num_parallel_calls=self.num_parallel_calls, prefetch_mb=self.prefetch_mb,
+                                                local_replicas=self.local_replicas, sess=self.sess)
+
+        if self.synthetic :
+            # one random batch kept in memory and repeated, no disk or decode in the step time
+            batch = np.random.uniform(-1.0, 1.0, size=[self.batch_size, self.img_size, self.img_size, self.c_dim])
+            inputs = tf.data.Dataset.from_tensors(batch.astype(np.float32)).repeat()
+
+        elif self.shards :
+            # large sequential reads : shard_cycle shards interleaved, records shuffled in a shard_buffer window
+            Image_Data_Class = ImageData(self.img_size, self.img_size, self.c_dim, self.custom_dataset,
+                                         batch_augment=self.augment_on != 'image', scaled_decode=self.scaled_decode)
+            inputs = build_shard_dataset(self.shard_meta['shards'], self.shard_meta['compression'], self.shard_cycle,
+                                         num_shards=self.num_replicas, shard_index=self.rank)
+            inputs = build_input_pipeline(inputs, Image_Data_Class.record_processing, self.batch_size, self.shard_buffer,
+                                          pipeline_config,
+                                          batch_func=Image_Data_Class.augment_batch if self.augment_on == 'batch' else None)
+
+        elif self.cache :
+            # decoded once into a uint8 memmap, batches are gathered by index without any decode
+            cache_path = image_cache_path(self.cache_dir, self.dataset_name, self.img_size, self.c_dim)
+            cache = load_image_cache(self.data, cache_path, self.img_size, self.c_dim, build=False)
+
+            Image_Data_Class = ImageData(self.img_size, self.img_size, self.c_dim, self.custom_dataset, cache=cache,
+                                         batch_augment=self.augment_on != 'image')
+            inputs = tf.data.Dataset.range(self.dataset_num)
+            inputs = build_input_pipeline(inputs, Image_Data_Class.cache_processing, self.batch_size, self.dataset_num,
+                                          pipeline_config, map_after_batch=True,
+                                          num_shards=self.num_replicas, shard_index=self.rank,
+                                          batch_func=Image_Data_Class.augment_batch if self.augment_on == 'batch' else None)
+
+        else :
+            if self.scaled_decode and self.is_chief :
+                decode_quality_report(self.data, self.img_size, self.img_size, self.c_dim)
+
+            Image_Data_Class = ImageData(self.img_size, self.img_size, self.c_dim, self.custom_dataset,
+                                         batch_augment=self.augment_on != 'image', scaled_decode=self.scaled_decode)
+            inputs = tf.data.Dataset.from_tensor_slices(self.data)
+            inputs = build_input_pipeline(inputs, Image_Data_Class.image_processing, self.batch_size, self.dataset_num,
+                                          pipeline_config, num_shards=self.num_replicas, shard_index=self.rank,
+                                          batch_func=Image_Data_Class.augment_batch if self.augment_on == 'batch' else None)
+
         inputs_iterator = inputs.make_one_shot_iterator()
 
-        self.inputs = inputs_iterator.get_next()
+        if self.augment_on == 'device' and not self.synthetic :
+            # the input workers only decode, the batch is augmented by the graph on the compute device
+            next_batch = lambda: Image_Data_Class.augment_batch(inputs_iterator.get_next())
+        else :
+            next_batch = inputs_iterator.get_next
+
+        # staging area on the compute device : the update reads the head batch, the next one is put in the same run
+        self.input_stage = tf.contrib.staging.StagingArea(dtypes=[tf.float32], names=['images'], capacity=2,
+                                                          shapes=[[self.batch_size, self.img_size, self.img_size, self.c_dim]])
+
+        # time blocked on the input iterator, measured in the graph around get_next and fetched with every D update
+        wait_start = tf.timestamp()
+        with tf.control_dependencies([wait_start]):
+            batch = next_batch()
+        with tf.control_dependencies([batch]):
+            self.input_wait = tf.timestamp() - wait_start
+
+        self.stage_inputs = self.input_stage.put({'images': batch})
+
+        self.inputs = self.input_stage.peek(0)['images']
         
         # noises
         self.z = tf.random_normal(shape=[self.batch_size, 1, 1, self.z_dim], name='random_z')
         
         """ Loss Function """
-        # output of D for real images
-        real_logits = self.discriminator(self.inputs)
-
-        # output of D for fake images
+        # output of D for real and fake images
         fake_images = self.generator(self.z)
-        fake_logits = self.discriminator(fake_images, reuse=True)
+        real_logits, fake_logits = self.discriminate(self.inputs, fake_images)
         
         # get loss for discriminator
-        self.d_loss = discriminator_loss(self.gan_type, real=real_logits, fake=fake_logits)
+        self.d_loss = discriminator_loss(False, self.gan_type, real=real_logits, fake=fake_logits)
 
         # get loss for generator
-        self.g_loss = generator_loss(self.gan_type, fake=fake_logits)
+        self.g_loss = generator_loss(False, self.gan_type, real=real_logits, fake=fake_logits)
+
+        # gradient penalties, None when the loss has none
+        self.d_reg = self.regularization(self.inputs, fake_images, real_logits)
 
+        """ Training """
         t_vars = tf.trainable_variables()
-        for var in t_vars: 
-            if 'discriminator' in var.name:
-                d_vars = [var]
-        for var in t_vars: 
-            if 'generator' in var.name:
-                g_vars = [var]
-            
-    
+        d_vars = [var for var in t_vars if 'discriminator' in var.name]
+        g_vars = [var for var in t_vars if 'generator' in var.name]
 
-        
-    def train():
-        train
-        
+        # lazy regularization : one penalty update every reg_every iterations stands in for reg_every * n_critic of them
+        reg_interval = self.reg_every * self.n_critic if self.d_reg is not None and self.reg_every > 1 else 0
+
+        # dynamic loss scaling under float16
+        if reg_interval :
+            d_optimizer = loss_scale_optimizer(lazy_regularization_adam(self.d_lr, self.beta1, self.beta2, reg_interval))
+        else :
+            d_optimizer = loss_scale_optimizer(tf.train.AdamOptimizer(self.d_lr, beta1=self.beta1, beta2=self.beta2))
+        g_optimizer = loss_scale_optimizer(tf.train.AdamOptimizer(self.g_lr, beta1=self.beta1, beta2=self.beta2))
+
+        if self.hvd :
+            # gradients are averaged over all replicas with an all-reduce before every update
+            d_optimizer = self.hvd.DistributedOptimizer(d_optimizer)
+            g_optimizer = self.hvd.DistributedOptimizer(g_optimizer)
+
+        if self.d_reg is not None and self.reg_every == 1 :
+            self.d_optim = d_optimizer.minimize(self.d_loss + self.d_reg, var_list=d_vars)
+        else :
+            self.d_optim = d_optimizer.minimize(self.d_loss, var_list=d_vars)
+
+        self.g_optim = g_optimizer.minimize(self.g_loss, var_list=g_vars)
+
+        # the penalty update is scaled by the interval to keep its strength
+        self.d_reg_optim = None
+        if reg_interval :
+            self.d_reg_optim = d_optimizer.minimize(self.d_reg * reg_interval, var_list=d_vars)
+
+        # D update, then the head batch is dropped, the put of the next one overlaps the update
+        with tf.control_dependencies([self.d_optim]):
+            self.d_step = tf.group(self.input_stage.get(), self.stage_inputs)
+
+        # the lazy penalty advances the staging area the same way, every penalty update sees a fresh batch
+        self.d_reg_step = None
+        if self.d_reg_optim is not None :
+            with tf.control_dependencies([self.d_reg_optim]):
+                self.d_reg_step = tf.group(self.input_stage.get(), self.stage_inputs)
+
+        # the --loop_steps loop reads its batches with next_batch, this moves the staged one on for runs outside it
+        self.next_inputs = tf.group(self.input_stage.get(), self.stage_inputs)
+
+        if self.hvd :
+            # batch norm moving statistics are averaged after every G update, so all replicas hold the same ones
+            bn_vars = [var for var in tf.global_variables() if 'moving_' in var.op.name and 'Adam' not in var.op.name]
+            with tf.control_dependencies([self.g_optim]):
+                self.g_optim = tf.group(*[var.assign(self.hvd.allreduce(var)) for var in bn_vars])
+
+        if self.loop_steps > 0 :
+            self.build_train_loop(next_batch, d_optimizer, g_optimizer, d_vars, g_vars)
+
+        if self.precision != 'float32' :
+            # float32 losses on the same batch and weights, fetched every print_freq to check the reduced precision
+            fake_images_fp32 = self.generator(self.z, reuse=True, dtype=tf.float32)
+            real_logits_fp32, fake_logits_fp32 = self.discriminate(self.inputs, fake_images_fp32, reuse=True, dtype=tf.float32)
+
+            self.d_loss_fp32 = discriminator_loss(False, self.gan_type, real=real_logits_fp32, fake=fake_logits_fp32)
+            self.g_loss_fp32 = generator_loss(False, self.gan_type, real=real_logits_fp32, fake=fake_logits_fp32)
+
+            # batch norm moving statistics and spectral norm u : every training-mode forward assigns them
+            t_vars = set(tf.trainable_variables())
+            self.model_state = [var for var in tf.global_variables() if var not in t_vars and 'Adam' not in var.op.name
+                                and var.op.name.split('/')[0] in ['generator', 'discriminator']]
+
+        """" Testing """
+        # for test
+        self.fake_images = self.generator(self.z, is_training=False, reuse=True)
+
+        """ Summary """
+        self.d_sum = tf.summary.scalar("d_loss", self.d_loss)
+        if self.d_reg is not None and self.reg_every == 1 :
+            self.d_sum = tf.summary.merge([self.d_sum, tf.summary.scalar("d_reg", self.d_reg)])
+        self.g_sum = tf.summary.scalar("g_loss", self.g_loss)
+
+    def build_train_loop(self, next_batch, d_optimizer, g_optimizer, d_vars, g_vars):
+        """
+        loop_steps x (n_critic D updates + 1 G update) in one tf.while_loop, every update draws its own batch with next_batch
+        the optimizers already built their slots with d_optim / g_optim, so the loop body reuses them
+        only the losses of the last updates come back
+        """
+        def losses(real, with_reg=False):
+            z = tf.random_normal(shape=[self.batch_size, 1, 1, self.z_dim])
+            fake = self.generator(z, reuse=True)
+            real_logits, fake_logits = self.discriminate(real, fake, reuse=True)
+
+            d_loss = discriminator_loss(False, self.gan_type, real=real_logits, fake=fake_logits)
+            g_loss = generator_loss(False, self.gan_type, real=real_logits, fake=fake_logits)
+
+            # eager penalties only, lazy ones run as d_reg_optim outside the loop
+            d_reg = self.regularization(real, fake, real_logits) if with_reg and self.reg_every == 1 else None
+
+            return d_loss, g_loss, d_reg
+
+        def d_step(i, d_loss):
+            # the control dependency orders every read of the weights after the previous update
+            with tf.control_dependencies([d_loss]):
+                d_loss, _, d_reg = losses(next_batch(), with_reg=True)
+                d_update = d_optimizer.minimize(d_loss if d_reg is None else d_loss + d_reg, var_list=d_vars)
+
+            with tf.control_dependencies([d_update]):
+                return i + 1, tf.identity(d_loss)
+
+        def g_step(i, d_loss, g_loss):
+            with tf.control_dependencies([d_loss, g_loss]):
+                _, d_loss = tf.while_loop(lambda j, _: j < self.n_critic, d_step, [tf.constant(0), tf.identity(d_loss)],
+                                          parallel_iterations=1)
+
+            with tf.control_dependencies([d_loss]):
+                _, g_loss, _ = losses(next_batch())
+                g_update = g_optimizer.minimize(g_loss, var_list=g_vars)
+
+            with tf.control_dependencies([g_update]):
+                return i + 1, tf.identity(d_loss), tf.identity(g_loss)
+
+        with tf.name_scope('train_loop'):
+            _, self.loop_d_loss, self.loop_g_loss = tf.while_loop(lambda i, *_: i < self.loop_steps, g_step,
+                                                                  [tf.constant(0), tf.constant(0.0), tf.constant(0.0)],
+                                                                  parallel_iterations=1)
+            self.loop_optim = tf.group(self.loop_d_loss, self.loop_g_loss)
+
+            if self.hvd :
+                # moving statistics are averaged once per loop instead of after every G update
+                bn_vars = [var for var in tf.global_variables() if 'moving_' in var.op.name and 'Adam' not in var.op.name]
+                with tf.control_dependencies([self.loop_optim]):
+                    self.loop_optim = tf.group(*[var.assign(self.hvd.allreduce(var)) for var in bn_vars])
+
+    def regularization(self, real, fake, real_logits):
+        penalty = []
+
+        if 'gp' in self.gan_type or 'lp' in self.gan_type or 'dragan' in self.gan_type :
+            penalty.append(self.gradient_penalty(real, fake))
+
+        if self.r1_gamma > 0 :
+            penalty.append(simple_gp(real_logits, None, real, None, r1_gamma=self.r1_gamma, r2_gamma=0))
+
+        return tf.add_n(penalty) if penalty else None
+
+    def gradient_penalty(self, real, fake):
+        if 'dragan' in self.gan_type :
+            eps = tf.random_uniform(shape=tf.shape(real), minval=0., maxval=1.)
+            _, x_var = tf.nn.moments(real, axes=[0, 1, 2, 3])
+            x_std = tf.sqrt(x_var)  # magnitude of noise decides the size of local region
+
+            fake = real + 0.5 * x_std * eps
+
+        alpha = tf.random_uniform(shape=[self.batch_size, 1, 1, 1], minval=0., maxval=1.)
+        interpolated = real + alpha * (fake - real)
+
+        logit = self.discriminator(interpolated, reuse=True)
+
+        grad = tf.gradients(logit, interpolated)[0]  # gradient of D(interpolated)
+        grad_norm = tf.norm(flatten(grad), axis=1)  # l2 norm
+
+        # WGAN - LP
+        if 'lp' in self.gan_type :
+            GP = self.ld * tf.reduce_mean(tf.square(tf.maximum(0.0, grad_norm - 1.)))
+
+        else :
+            GP = self.ld * tf.reduce_mean(tf.square(grad_norm - 1.))
+
+        return GP
+
+    def build_test_model(self):
+        # generator only : no input pipeline, discriminator, losses or optimizer slots
+        self.z = tf.placeholder_with_default(tf.random_normal(shape=[self.batch_size, 1, 1, self.z_dim], name='random_z'),
+                                             shape=[self.batch_size, 1, 1, self.z_dim], name='z')
+        self.fake_images = self.generator(self.z, is_training=False)
+
+    def train(self):
+        # initialize all variables
+        tf.global_variables_initializer().run()
+        tf.local_variables_initializer().run()
+
+        # graph inputs for visualize training results
+        self.sample_z = np.random.normal(size=(self.batch_size, 1, 1, self.z_dim))
+
+        # saver to save model
+        self.saver = tf.train.Saver()
+
+        # background checkpoint writers : full model, and a small generator-only stream
+        # with data parallel replicas only the chief writes checkpoints, samples and summaries
+        self.checkpointer = None
+        self.g_checkpointer = None
+        self.writer = None
+
+        if self.is_chief :
+            self.checkpointer = AsyncCheckpointer(self.sess, tf.global_variables(),
+                                                  os.path.join(self.checkpoint_dir, self.model_dir), self.model_name,
+                                                  keep_last=self.keep_last, keep_every=self.keep_every)
+            self.g_checkpointer = AsyncCheckpointer(self.sess, generator_variables(),
+                                                    os.path.join(self.checkpoint_dir, self.model_dir, 'generator'), self.model_name,
+                                                    keep_last=self.keep_last, write_meta_graph=False, scope='g_snapshot')
+
+            # summary writer
+            self.writer = tf.summary.FileWriter(self.log_dir + '/' + self.model_dir, self.sess.graph)
+
+            # step timings and images/sec
+            self.throughput = ThroughputLogger(self.log_dir + '/' + self.model_dir,
+                                               self.batch_size * self.num_replicas, writer=self.writer)
+
+        # restore check-point if it exits
+        could_load, checkpoint_counter = self.load(self.checkpoint_dir)
+        if could_load:
+            start_epoch = (int)(checkpoint_counter / self.iteration)
+            start_batch_id = checkpoint_counter - start_epoch * self.iteration
+            counter = checkpoint_counter
+            print(" [*] Load SUCCESS")
+        else:
+            start_epoch = 0
+            start_batch_id = 0
+            counter = 1
+            print(" [!] Load failed...")
+
+        if self.hvd :
+            # every replica starts from the chief's weights
+            self.sess.run(self.hvd.broadcast_global_variables(0))
+
+        # first batch into the staging area, every D run after this stages the next one
+        self.sess.run(self.stage_inputs)
+
+        # loop for epoch, one pass of the inner loop runs steps G updates
+        steps = self.loop_steps if self.loop_steps > 0 else 1
+        start_time = time.time()
+        for epoch in range(start_epoch, self.epoch):
+            # get batch data
+            for idx in range(start_batch_id, self.iteration, steps):
+                # true when this pass reaches a multiple of freq
+                crossings = lambda freq: (idx + steps) // freq - idx // freq
+                crossed = lambda freq: crossings(freq) > 0
+
+                # losses and summaries are only fetched every print_freq steps, other steps run the updates alone
+                fetch_losses = crossed(self.print_freq)
+                step_start = time.time()
+
+                # full execution trace for the steps asked with --trace_steps
+                trace = self.is_chief and any(step in self.trace_steps for step in range(counter, counter + steps))
+
+                if self.loop_steps > 0 :
+                    # every update of the pass in one run, batches are read inside the graph
+                    loop_fetches = [self.loop_optim, self.loop_d_loss, self.loop_g_loss]
+                    _, d_loss, g_loss = self.run_traced(loop_fetches, 'loop', counter) if trace else self.sess.run(loop_fetches)
+
+                    if self.d_reg_step is not None and crossed(self.reg_every) :
+                        for _ in range(crossings(self.reg_every)):
+                            self.sess.run(self.d_reg_step)
+
+                    g_end = time.time()
+
+                    if not self.is_chief :
+                        counter += steps
+                        continue
+
+                    if fetch_losses :
+                        self.writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag='d_loss', simple_value=d_loss),
+                                                                  tf.Summary.Value(tag='g_loss', simple_value=g_loss)]), counter)
+                    else :
+                        d_loss, g_loss = None, None
+
+                    # the input / D / G split is not visible from outside the loop, only the time per G step is logged
+                    self.throughput.log(counter, (g_end - step_start) / steps, d_loss=d_loss, g_loss=g_loss)
+
+                else :
+                    # update D network, the next input batch is staged by the same run
+                    data_time = 0.0
+                    for critic in range(self.n_critic):
+                        d_fetches = [self.d_step, self.input_wait] + ([self.d_sum, self.d_loss] if fetch_losses else [])
+                        # one trace file and tag per critic update, d0, d1, ... when n_critic > 1
+                        d_name = 'd{}'.format(critic) if self.n_critic > 1 else 'd'
+                        d_results = self.run_traced(d_fetches, d_name, counter) if trace else self.sess.run(d_fetches)
+                        data_time += d_results[1]
+
+                    # lazy penalty update on the staged batch
+                    if self.d_reg_step is not None and crossed(self.reg_every) :
+                        self.sess.run(self.d_reg_step)
+
+                    d_end = time.time()
+                    d_time = d_end - step_start
+
+                    # update G network
+                    g_fetches = [self.g_optim, self.g_sum, self.g_loss] if fetch_losses else self.g_optim
+                    g_results = self.run_traced(g_fetches, 'g', counter) if trace else self.sess.run(g_fetches)
+                    g_end = time.time()
+
+                    if not self.is_chief :
+                        counter += 1
+                        continue
+
+                    d_loss, g_loss = None, None
+                    if fetch_losses :
+                        _, _, d_summary_str, d_loss = d_results
+                        _, g_summary_str, g_loss = g_results
+                        self.writer.add_summary(d_summary_str, counter)
+                        self.writer.add_summary(g_summary_str, counter)
+
+                    # the put overlaps the D update, d_time includes the part of data_time the update did not hide
+                    self.throughput.log(counter, g_end - step_start, data_time, d_time, g_end - d_end, d_loss, g_loss)
+
+                counter += steps
+
+                if fetch_losses:
+                    # display training status
+                    throughput = self.throughput.summarize(counter - 1)
+                    data_wait = ", data wait: %.1f%%" % (throughput['data_wait_ratio'] * 100) if 'data_wait_ratio' in throughput else ""
+                    print("Epoch: [%2d] [%5d/%5d] time: %4.4f, d_loss: %.8f, g_loss: %.8f, images/sec: %.1f%s" \
+                          % (epoch, idx, self.iteration, time.time() - start_time, d_loss, g_loss,
+                             throughput['images_per_sec'], data_wait))
+
+                    if self.precision != 'float32' :
+                        self.precision_parity()
+
+                    samples = self.sess.run(self.fake_images, feed_dict={self.z: self.sample_z})
+                    tot_num_samples = min(self.sample_num, self.batch_size)
+                    manifold_h = int(np.floor(np.sqrt(tot_num_samples)))
+                    manifold_w = int(np.floor(np.sqrt(tot_num_samples)))
+
+                    # handed to the background writer, the next step starts immediately
+                    self.image_writer.save_images(samples[:manifold_h * manifold_w, :, :, :],
+                                                  [manifold_h, manifold_w],
+                                                  './' + self.sample_dir + '/' + self.model_name + '_train_{:02d}_{:05d}.png'.format(epoch, idx + 1))
+
+                if crossed(self.save_freq):
+                    self.save(self.checkpoint_dir, counter)
+
+                if self.g_checkpointer and self.g_save_freq > 0 and crossed(self.g_save_freq):
+                    self.g_checkpointer.save(counter)
+
+            # After an epoch, start_batch_id is set to zero
+            # non-zero value is only for the first epoch after loading pre-trained model
+            start_batch_id = 0
+
+            # save model
+            self.save(self.checkpoint_dir, counter)
+
+        # save model for final step
+        self.save(self.checkpoint_dir, counter)
+
+        if self.is_chief :
+            self.checkpointer.wait()
+            self.g_checkpointer.wait()
+            self.throughput.close()
+
+    def run_traced(self, fetches, name, step):
+        run_metadata = tf.RunMetadata()
+        results = self.sess.run(fetches, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                                run_metadata=run_metadata)
+
+        write_trace(run_metadata, os.path.join(self.log_dir, self.model_dir, 'trace_{}_step{}.json'.format(name, step)))
+        self.writer.add_run_metadata(run_metadata, '{}_step{}'.format(name, step), step)
+
+        return results
+
+    def precision_parity(self):
+        if self.loop_steps > 0 :
+            # the in-graph loop does not advance the staging area, compare on a fresh batch
+            self.sess.run(self.next_inputs)
+
+        # both precisions run in training mode like the real step, the state they assign is put back afterwards
+        state = self.sess.run(self.model_state)
+
+        d_loss, g_loss, d_loss_fp32, g_loss_fp32 = self.sess.run([self.d_loss, self.g_loss, self.d_loss_fp32, self.g_loss_fp32])
+
+        for var, value in zip(self.model_state, state):
+            var.load(value, self.sess)
+
+        print(" [*] {} parity : d_loss {:.6f} / {:.6f} (float32), g_loss {:.6f} / {:.6f} (float32)".format(
+            self.precision, d_loss, d_loss_fp32, g_loss, g_loss_fp32))
+
+        return abs(d_loss - d_loss_fp32), abs(g_loss - g_loss_fp32)
+
+    def visualize_results(self, epoch):
+        if not self.is_chief :
+            return
+
+        tot_num_samples = min(self.sample_num, self.batch_size)
+        image_frame_dim = int(np.floor(np.sqrt(tot_num_samples)))
+
+        z_sample = np.random.normal(size=(self.batch_size, 1, 1, self.z_dim))
+        samples = self.sess.run(self.fake_images, feed_dict={self.z: z_sample})
+
+        self.image_writer.save_images(samples[:image_frame_dim * image_frame_dim, :, :, :],
+                                      [image_frame_dim, image_frame_dim],
+                                      self.sample_dir + '/' + self.model_name + '_epoch%02d' % epoch + '_visualize.png')
+
+    @property
     def model_dir(self):
         if self.sn :
             sn = '_sn'
         else :
             sn = ''
 
-        return "{}_{}_{}_{}_{}_{}{}".format(
-            self.model_name, self.dataset_name, self.gan_type, self.img_size, self.z_dim, self.moment, sn)
+        return "{}_{}_{}_{}_{}{}".format(
+            self.model_name, self.dataset_name, self.gan_type, self.img_size, self.z_dim, sn)
     
     def save(self, checkpoint_dir, step):
-        checkpoint_dir = os.path.join(checkpoint_dir, self.model_dir)
-
-        if not os.path.exists(checkpoint_dir):
-            os.makedirs(checkpoint_dir)
+        # snapshot in memory, written to checkpoint_dir/model_dir by self.checkpointer in the background
+        if self.checkpointer is None :
+            return
 
-        self.saver.save(self.sess, os.path.join(checkpoint_dir, self.model_name + '.model'), global_step=step)
+        self.checkpointer.save(step)
 
     def load(self, checkpoint_dir):
         print(" [*] Reading checkpoints...")
@@ -191,9 +713,92 @@ class DCGAN(object):
             print(" [*] Failed to find a checkpoint")
             return False, 0
         
-    def test(): 
-        test
-    
-    
+    def load_generator(self, checkpoint_dir):
+        print(" [*] Reading generator checkpoints...")
+        checkpoint_dir = os.path.join(checkpoint_dir, self.model_dir)
+
+        # the generator-only stream is much smaller, use it unless the full checkpoint is newer
+        candidates = []
+        for ckpt_dir in [os.path.join(checkpoint_dir, 'generator'), checkpoint_dir]:
+            ckpt = tf.train.get_checkpoint_state(ckpt_dir)
+            if ckpt and ckpt.model_checkpoint_path:
+                ckpt_name = os.path.basename(ckpt.model_checkpoint_path)
+                candidates.append((int(ckpt_name.split('-')[-1]), os.path.join(ckpt_dir, ckpt_name)))
+
+        if not candidates:
+            print(" [*] Failed to find a checkpoint")
+            return False, 0
+
+        counter, ckpt_path = max(candidates, key=lambda x: x[0])
+
+        # a saver over the generator variables only looks up those tensors in the checkpoint index,
+        # the discriminator and optimizer slots are never read
+        self.saver = tf.train.Saver(var_list=generator_variables())
+        self.saver.restore(self.sess, ckpt_path)
+        print(" [*] Success to read {}".format(ckpt_path))
+
+        return True, counter
+
+    def test(self):
+        tf.global_variables_initializer().run()
+
+        could_load, checkpoint_counter = self.load_generator(self.checkpoint_dir)
+
+        result_dir = os.path.join(self.result_dir, self.model_dir)
+        check_folder(result_dir)
+
+        if could_load:
+            print(" [*] Load SUCCESS")
+        else:
+            print(" [!] Load failed...")
+
+        tot_num_samples = min(self.sample_num, self.batch_size)
+        image_frame_dim = int(np.floor(np.sqrt(tot_num_samples)))
+
+        """ random condition, random noise """
+        for i in range(self.test_num):
+            z_sample = np.random.normal(size=(self.batch_size, 1, 1, self.z_dim))
+            samples = self.sess.run(self.fake_images, feed_dict={self.z: z_sample})
+
+            self.image_writer.save_images(samples[:image_frame_dim * image_frame_dim, :, :, :],
+                                          [image_frame_dim, image_frame_dim],
+                                          result_dir + '/' + self.model_name + '_test_{}.png'.format(i))
+
+
+    def export(self):
+        could_load, checkpoint_counter = self.load_generator(self.checkpoint_dir)
+        if not could_load:
+            print(" [!] Load failed...")
+            return
+
+        output_name = 'generated'
+        tf.identity(self.fake_images, name=output_name)
+
+        # variables -> constants, then drop identities and everything the output does not depend on
+        graph_def = tf.graph_util.convert_variables_to_constants(self.sess, self.sess.graph.as_graph_def(), [output_name])
+        graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=['z', output_name])
+        folded_def = fold_batch_norms(graph_def)
+        folded_def = tf.graph_util.extract_sub_graph(folded_def, [output_name])
+
+        # the folded graph must reproduce the restored generator
+        z_sample = np.random.normal(size=(self.batch_size, 1, 1, self.z_dim))
+        feed_dict = {'z:0': z_sample}
+        reference = run_frozen_graph(graph_def, feed_dict, output_name + ':0')
+        exported = run_frozen_graph(folded_def, feed_dict, output_name + ':0')
+
+        max_diff = np.max(np.abs(reference - exported))
+        if max_diff > 1e-4 :
+            raise ValueError(" [!] Folded generator differs from the restored one by {:.3e}, nothing exported".format(max_diff))
+
+        export_path = self.export_path or os.path.join(self.checkpoint_dir, self.model_dir,
+                                                       self.model_name + '_generator_{}.pb'.format(checkpoint_counter))
+        with tf.gfile.GFile(export_path, 'wb') as f:
+            f.write(folded_def.SerializeToString())
+
+        print(" [*] Frozen generator : {} -> {} ops, max abs diff : {:.3e}".format(
+            len(graph_def.node), len(folded_def.node), max_diff))
+        print(" [*] Export {} (input 'z:0' [{}, 1, 1, {}], output '{}:0')".format(
+            export_path, self.batch_size, self.z_dim, output_name))
+
     def generate_image():
         generate
\ No newline at end of file
@@ -54,8 +54,52 @@ tensorflow  : trunc_stddev = sqrt(1.3 * factor * 2 / fan_in)
 # weight_init = tf_contrib.layers.variance_scaling_initializer(factor=factor, mode=mode, uniform=uniform)
 
 weight_init = tf.truncated_normal_initializer(mean=0.0, stddev=0.02)
-weight_regularizer = tf.contrib.layers.l2_regularizer(0.0001)
-weight_regularizer_fully = tf.contrib.layers.l2_regularizer(0.0001)
+
+def l2_regularizer(scale):
+    # tf.contrib.layers.l2_regularizer built on first use, importing ops does not load tf.contrib
+    def regularizer(weights):
+        return tf.contrib.layers.l2_regularizer(scale)(weights)
+
+    return regularizer
+
+weight_regularizer = l2_regularizer(0.0001)
+weight_regularizer_fully = l2_regularizer(0.0001)
+
+##################################################################################
+# Precision
+##################################################################################
+
+# float32 / float16 : dtype of the activations, variables are always stored in float32
+# no bfloat16 : tensorflow 1.x has no bfloat16 conv kernels on gpu or cpu
+precision_dtypes = {'float32': tf.float32, 'float16': tf.float16}
+precision_policy = {'compute_dtype': tf.float32}
+
+def set_precision(precision='float32'):
+    if precision not in precision_dtypes :
+        raise ValueError(" [!] Unsupported precision {}, use one of {}".format(precision, sorted(precision_dtypes)))
+
+    precision_policy['compute_dtype'] = precision_dtypes[precision]
+
+def float32_variable_getter(getter, name, shape=None, dtype=None, *args, **kwargs):
+    """ custom_getter : a layer asking for a float16 variable gets a cast of a float32 master variable """
+    storage_dtype = tf.float32 if dtype == tf.float16 else dtype
+    variable = getter(name, shape, storage_dtype, *args, **kwargs)
+
+    if storage_dtype != dtype:
+        variable = tf.cast(variable, dtype)
+
+    return variable
+
+def loss_scale_optimizer(optimizer):
+    # float16 gradients underflow without loss scaling
+    if precision_policy['compute_dtype'] != tf.float16:
+        return optimizer
+
+    loss_scale_manager = tf.contrib.mixed_precision.ExponentialUpdateLossScaleManager(init_loss_scale=2 ** 15,
+                                                                                       incr_every_n_steps=2000,
+                                                                                       decr_every_n_nan_or_inf=2,
+                                                                                       decr_ratio=0.5)
+    return tf.contrib.mixed_precision.LossScaleOptimizer(optimizer, loss_scale_manager)
 
 ##################################################################################
 # Layers
@@ -84,11 +128,11 @@ def conv(x, channels, kernel=4, stride=2, pad=0, pad_type='zero', use_bias=True,
         if sn:
             w = tf.get_variable("kernel", shape=[kernel, kernel, x.get_shape()[-1], channels], initializer=weight_init,
                                 regularizer=weight_regularizer)
-            x = tf.nn.conv2d(input=x, filter=spectral_norm(w),
+            x = tf.nn.conv2d(input=x, filter=tf.cast(spectral_norm(w), x.dtype),
                              strides=[1, stride, stride, 1], padding='VALID')
             if use_bias:
                 bias = tf.get_variable("bias", [channels], initializer=tf.constant_initializer(0.0))
-                x = tf.nn.bias_add(x, bias)
+                x = tf.nn.bias_add(x, tf.cast(bias, x.dtype))
 
         else:
             x = tf.layers.conv2d(inputs=x, filters=channels,
@@ -106,7 +150,7 @@ def partial_conv(x, channels, kernel=3, stride=2, use_bias=True, padding='SAME',
                 _, h, w, _ = x.get_shape().as_list()
 
                 slide_window = kernel * kernel
-                mask = tf.ones(shape=[1, h, w, 1])
+                mask = tf.ones(shape=[1, h, w, 1], dtype=x.dtype)
 
                 update_mask = tf.layers.conv2d(mask, filters=1,
                                                kernel_size=kernel, kernel_initializer=tf.constant_initializer(1.0),
@@ -120,7 +164,7 @@ def partial_conv(x, channels, kernel=3, stride=2, use_bias=True, padding='SAME',
                 if sn:
                     w = tf.get_variable("kernel", shape=[kernel, kernel, x.get_shape()[-1], channels],
                                         initializer=weight_init, regularizer=weight_regularizer)
-                    x = tf.nn.conv2d(input=x, filter=spectral_norm(w), strides=[1, stride, stride, 1], padding=padding)
+                    x = tf.nn.conv2d(input=x, filter=tf.cast(spectral_norm(w), x.dtype), strides=[1, stride, stride, 1], padding=padding)
                 else:
                     x = tf.layers.conv2d(x, filters=channels,
                                          kernel_size=kernel, kernel_initializer=weight_init,
@@ -131,17 +175,17 @@ def partial_conv(x, channels, kernel=3, stride=2, use_bias=True, padding='SAME',
                 if use_bias:
                     bias = tf.get_variable("bias", [channels], initializer=tf.constant_initializer(0.0))
 
-                    x = tf.nn.bias_add(x, bias)
+                    x = tf.nn.bias_add(x, tf.cast(bias, x.dtype))
                     x = x * update_mask
         else:
             if sn:
                 w = tf.get_variable("kernel", shape=[kernel, kernel, x.get_shape()[-1], channels],
                                     initializer=weight_init, regularizer=weight_regularizer)
-                x = tf.nn.conv2d(input=x, filter=spectral_norm(w), strides=[1, stride, stride, 1], padding=padding)
+                x = tf.nn.conv2d(input=x, filter=tf.cast(spectral_norm(w), x.dtype), strides=[1, stride, stride, 1], padding=padding)
                 if use_bias:
                     bias = tf.get_variable("bias", [channels], initializer=tf.constant_initializer(0.0))
 
-                    x = tf.nn.bias_add(x, bias)
+                    x = tf.nn.bias_add(x, tf.cast(bias, x.dtype))
             else:
                 x = tf.layers.conv2d(x, filters=channels,
                                      kernel_size=kernel, kernel_initializer=weight_init,
@@ -156,13 +200,13 @@ def dilate_conv(x, channels, kernel=3, rate=2, use_bias=True, padding='SAME', sn
         w = tf.get_variable("kernel", shape=[kernel, kernel, x.get_shape()[-1], channels], initializer=weight_init,
                             regularizer=weight_regularizer)
         if sn:
-            x = tf.nn.atrous_conv2d(x, spectral_norm(w), rate=rate, padding=padding)
+            x = tf.nn.atrous_conv2d(x, tf.cast(spectral_norm(w), x.dtype), rate=rate, padding=padding)
         else:
-            x = tf.nn.atrous_conv2d(x, w, rate=rate, padding=padding)
+            x = tf.nn.atrous_conv2d(x, tf.cast(w, x.dtype), rate=rate, padding=padding)
 
         if use_bias:
             bias = tf.get_variable("bias", [channels], initializer=tf.constant_initializer(0.0))
-            x = tf.nn.bias_add(x, bias)
+            x = tf.nn.bias_add(x, tf.cast(bias, x.dtype))
 
         return x
 
@@ -181,12 +225,12 @@ def deconv(x, channels, kernel=4, stride=2, padding='SAME', use_bias=True, sn=Fa
         if sn:
             w = tf.get_variable("kernel", shape=[kernel, kernel, channels, x.get_shape()[-1]], initializer=weight_init,
                                 regularizer=weight_regularizer)
-            x = tf.nn.conv2d_transpose(x, filter=spectral_norm(w), output_shape=output_shape,
+            x = tf.nn.conv2d_transpose(x, filter=tf.cast(spectral_norm(w), x.dtype), output_shape=output_shape,
                                        strides=[1, stride, stride, 1], padding=padding)
 
             if use_bias:
                 bias = tf.get_variable("bias", [channels], initializer=tf.constant_initializer(0.0))
-                x = tf.nn.bias_add(x, bias)
+                x = tf.nn.bias_add(x, tf.cast(bias, x.dtype))
 
         else:
             x = tf.layers.conv2d_transpose(inputs=x, filters=channels,
@@ -226,9 +270,9 @@ def fully_connected(x, units, use_bias=True, sn=False, scope='linear'):
                 bias = tf.get_variable("bias", [units],
                                        initializer=tf.constant_initializer(0.0))
 
-                x = tf.matmul(x, spectral_norm(w)) + bias
+                x = tf.matmul(x, tf.cast(spectral_norm(w), x.dtype)) + tf.cast(bias, x.dtype)
             else:
-                x = tf.matmul(x, spectral_norm(w))
+                x = tf.matmul(x, tf.cast(spectral_norm(w), x.dtype))
 
         else:
             x = tf.layers.dense(x, units=units, kernel_initializer=weight_init,
@@ -395,27 +439,105 @@ def res_denseblock(x_init, channels, n_rdb=20, n_rdb_conv=6, use_bias=True, is_t
 
         return x
 
-def self_attention(x, channels, use_bias=True, sn=False, scope='self_attention'):
+def blocked_attention(q, k, v, block_size=1024):
+    """
+    softmax(q k^T) v over blocks of block_size keys with a running max and sum (streaming softmax)
+    neither the forward nor the backward pass holds the [bs, Nq, Nk] map, only [bs, Nq, block_size] at a time
+    q : [bs, Nq, d], k : [bs, Nk, d], v : [bs, Nk, c] -> [bs, Nq, c]
+    """
+    dtype = q.dtype
+    q, k, v = tf.cast(q, tf.float32), tf.cast(k, tf.float32), tf.cast(v, tf.float32)
+
+    bs, n_q, _ = q.get_shape().as_list()
+    _, n_k, d = k.get_shape().as_list()
+    c = v.get_shape().as_list()[-1]
+
+    # pad the keys to whole blocks, padded keys get a large negative logit
+    n_blocks = -(-n_k // block_size)
+    pad = n_blocks * block_size - n_k
+
+    k_blocks = tf.transpose(tf.reshape(tf.pad(k, [[0, 0], [0, pad], [0, 0]]), [bs, n_blocks, block_size, d]), [1, 0, 2, 3])
+    v_blocks = tf.transpose(tf.reshape(tf.pad(v, [[0, 0], [0, pad], [0, 0]]), [bs, n_blocks, block_size, c]), [1, 0, 2, 3])
+
+    mask = np.zeros([n_blocks * block_size], dtype=np.float32)
+    mask[n_k:] = -1e9
+    mask = tf.constant(mask.reshape([n_blocks, 1, 1, block_size]))
+
+    def block_logits(q, k_blocks, i):
+        return tf.matmul(q, tf.gather(k_blocks, i), transpose_b=True) + tf.gather(mask, i)  # [bs, Nq, block]
+
+    @tf.custom_gradient
+    def attention(q, k_blocks, v_blocks):
+        def body(i, m, l, o):
+            s = block_logits(q, k_blocks, i)
+            m_new = tf.maximum(m, tf.reduce_max(s, axis=-1, keepdims=True))
+            p = tf.exp(s - m_new)
+            rescale = tf.exp(m - m_new)
+
+            l = l * rescale + tf.reduce_sum(p, axis=-1, keepdims=True)
+            o = o * rescale + tf.matmul(p, tf.gather(v_blocks, i))
+
+            return i + 1, m_new, l, o
+
+        m = tf.fill([bs, n_q, 1], -1e30)
+        l = tf.zeros([bs, n_q, 1])
+        o = tf.zeros([bs, n_q, c])
+
+        _, m, l, o = tf.while_loop(lambda i, *_: i < n_blocks, body, [0, m, l, o], back_prop=False)
+
+        out = o / l
+        lse = m + tf.log(l)  # log-sum-exp per query, enough to rebuild any block of the softmax
+
+        def grad(d_out):
+            delta = tf.reduce_sum(d_out * out, axis=-1, keepdims=True)
+
+            def grad_body(i, dq, dk, dv):
+                p = tf.exp(block_logits(q, k_blocks, i) - lse)
+                dp = tf.matmul(d_out, tf.gather(v_blocks, i), transpose_b=True)
+                ds = p * (dp - delta)
+
+                dq = dq + tf.matmul(ds, tf.gather(k_blocks, i))
+                dk = dk.write(i, tf.matmul(ds, q, transpose_a=True))
+                dv = dv.write(i, tf.matmul(p, d_out, transpose_a=True))
+
+                return i + 1, dq, dk, dv
+
+            dk = tf.TensorArray(tf.float32, size=n_blocks)
+            dv = tf.TensorArray(tf.float32, size=n_blocks)
+            _, dq, dk, dv = tf.while_loop(lambda i, *_: i < n_blocks, grad_body, [0, tf.zeros_like(q), dk, dv],
+                                          back_prop=False)
+
+            return dq, dk.stack(), dv.stack()
+
+        return out, grad
+
+    return tf.cast(attention(q, k_blocks, v_blocks), dtype)
+
+def self_attention(x, channels, use_bias=True, sn=False, block_size=0, scope='self_attention'):
+    # block_size > 0 : streaming softmax over key blocks, see blocked_attention
     with tf.variable_scope(scope):
         f = conv(x, channels // 8, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='f_conv')  # [bs, h, w, c']
         g = conv(x, channels // 8, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='g_conv')  # [bs, h, w, c']
         h = conv(x, channels, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='h_conv')  # [bs, h, w, c]
 
-        # N = h * w
-        s = tf.matmul(hw_flatten(g), hw_flatten(f), transpose_b=True)  # # [bs, N, N]
+        if block_size > 0 :
+            o = blocked_attention(hw_flatten(g), hw_flatten(f), hw_flatten(h), block_size)  # [bs, N, C]
+        else :
+            # N = h * w
+            s = tf.matmul(hw_flatten(g), hw_flatten(f), transpose_b=True)  # # [bs, N, N]
 
-        beta = tf.nn.softmax(s)  # attention map
+            beta = tf.nn.softmax(s)  # attention map
 
-        o = tf.matmul(beta, hw_flatten(h))  # [bs, N, C]
+            o = tf.matmul(beta, hw_flatten(h))  # [bs, N, C]
         gamma = tf.get_variable("gamma", [1], initializer=tf.constant_initializer(0.0))
 
         o = tf.reshape(o, shape=x.shape)  # [bs, h, w, C]
-        x = gamma * o + x
+        x = tf.cast(gamma, x.dtype) * o + x
 
     return x
 
 
-def self_attention_with_pooling(x, channels, use_bias=True, sn=False, scope='self_attention'):
+def self_attention_with_pooling(x, channels, use_bias=True, sn=False, block_size=0, scope='self_attention'):
     with tf.variable_scope(scope):
         f = conv(x, channels // 8, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='f_conv')  # [bs, h, w, c']
         f = max_pooling(f)
@@ -425,17 +547,20 @@ def self_attention_with_pooling(x, channels, use_bias=True, sn=False, scope='sel
         h = conv(x, channels // 2, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='h_conv')  # [bs, h, w, c]
         h = max_pooling(h)
 
-        # N = h * w
-        s = tf.matmul(hw_flatten(g), hw_flatten(f), transpose_b=True)  # # [bs, N, N]
+        if block_size > 0 :
+            o = blocked_attention(hw_flatten(g), hw_flatten(f), hw_flatten(h), block_size)  # [bs, N, C]
+        else :
+            # N = h * w
+            s = tf.matmul(hw_flatten(g), hw_flatten(f), transpose_b=True)  # # [bs, N, N // 4]
 
-        beta = tf.nn.softmax(s)  # attention map
+            beta = tf.nn.softmax(s)  # attention map
 
-        o = tf.matmul(beta, hw_flatten(h))  # [bs, N, C]
+            o = tf.matmul(beta, hw_flatten(h))  # [bs, N, C]
         gamma = tf.get_variable("gamma", [1], initializer=tf.constant_initializer(0.0))
 
         o = tf.reshape(o, shape=[x.shape[0], x.shape[1], x.shape[2], channels // 2])  # [bs, h, w, C]
         o = conv(o, channels, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='attn_conv')
-        x = gamma * o + x
+        x = tf.cast(gamma, x.dtype) * o + x
 
     return x
 
@@ -489,22 +614,30 @@ def convolution_block_attention(x, channels, ratio=16, use_bias=True, sn=False,
             return x
 
 
-def global_context_block(x, channels, use_bias=True, sn=False, scope='gc_block'):
+def global_context_block(x, channels, use_bias=True, sn=False, block_size=0, scope='gc_block'):
     with tf.variable_scope(scope):
         with tf.variable_scope('context_modeling'):
             bs, h, w, c = x.get_shape().as_list()
-            input_x = x
-            input_x = hw_flatten(input_x)  # [N, H*W, C]
-            input_x = tf.transpose(input_x, perm=[0, 2, 1])
-            input_x = tf.expand_dims(input_x, axis=1)
 
             context_mask = conv(x, channels=1, kernel=1, stride=1, use_bias=use_bias, sn=sn, scope='conv')
-            context_mask = hw_flatten(context_mask)
-            context_mask = tf.nn.softmax(context_mask, axis=1)  # [N, H*W, 1]
-            context_mask = tf.transpose(context_mask, perm=[0, 2, 1])
-            context_mask = tf.expand_dims(context_mask, axis=-1)
 
-            context = tf.matmul(input_x, context_mask)
+            if block_size > 0 :
+                # one query whose logits are the mask : streaming softmax over the H*W positions, no transposed copy of x
+                query = tf.ones([bs, 1, 1], dtype=x.dtype)
+                context = blocked_attention(query, hw_flatten(context_mask), hw_flatten(x), block_size)  # [N, 1, C]
+            else :
+                input_x = x
+                input_x = hw_flatten(input_x)  # [N, H*W, C]
+                input_x = tf.transpose(input_x, perm=[0, 2, 1])
+                input_x = tf.expand_dims(input_x, axis=1)
+
+                context_mask = hw_flatten(context_mask)
+                context_mask = tf.nn.softmax(context_mask, axis=1)  # [N, H*W, 1]
+                context_mask = tf.transpose(context_mask, perm=[0, 2, 1])
+                context_mask = tf.expand_dims(context_mask, axis=-1)
+
+                context = tf.matmul(input_x, context_mask)
+
             context = tf.reshape(context, shape=[bs, 1, 1, c])
 
         with tf.variable_scope('transform_0'):
@@ -559,31 +692,80 @@ def batch_norm(x, is_training=False, scope='batch_norm'):
         train_op = optimizer.minimize(loss)
     """
 
-    return tf.contrib.layers.batch_norm(x,
-                                        decay=0.9, epsilon=1e-05,
-                                        center=True, scale=True, updates_collections=None,
-                                        is_training=is_training, scope=scope)
+    # statistics and parameters stay in float32 under a reduced precision policy
+    x_norm = tf.contrib.layers.batch_norm(tf.cast(x, tf.float32),
+                                          decay=0.9, epsilon=1e-05,
+                                          center=True, scale=True, updates_collections=None,
+                                          is_training=is_training, scope=scope)
+
+    return tf.cast(x_norm, x.dtype)
 
     # return tf.layers.batch_normalization(x, momentum=0.9, epsilon=1e-05, center=True, scale=True, training=is_training, name=scope)
 
 
+def split_batch_norm(x, is_training=False, num_splits=2, decay=0.9, epsilon=1e-05, scope='batch_norm'):
+    """
+    batch norm of a concatenated batch with separate statistics for each of num_splits equal parts
+    same variables as batch_norm, the moving statistics take the parts in order as if batch_norm ran on each
+    """
+    with tf.variable_scope(scope):
+        dtype = x.dtype
+        x = tf.cast(x, tf.float32)
+        bs, h, w, c = x.get_shape().as_list()
+
+        beta = tf.get_variable('beta', [c], initializer=tf.constant_initializer(0.0))
+        gamma = tf.get_variable('gamma', [c], initializer=tf.constant_initializer(1.0))
+
+        moving_mean = tf.get_variable('moving_mean', [c], initializer=tf.constant_initializer(0.0), trainable=False)
+        moving_var = tf.get_variable('moving_variance', [c], initializer=tf.constant_initializer(1.0), trainable=False)
+
+        if not is_training :
+            x_norm = tf.nn.batch_normalization(x, moving_mean, moving_var, beta, gamma, epsilon)
+            return tf.cast(x_norm, dtype)
+
+        x = tf.reshape(x, [num_splits, bs // num_splits, h, w, c])
+        batch_mean, batch_var = tf.nn.moments(x, axes=[1, 2, 3], keep_dims=True)
+
+        # moving variance with the unbiased estimate, as the fused kernel does
+        n = (bs // num_splits) * h * w
+        split_mean = tf.unstack(tf.reshape(batch_mean, [num_splits, c]))
+        split_var = tf.unstack(tf.reshape(batch_var, [num_splits, c]) * (n / max(n - 1, 1)))
+
+        new_mean, new_var = moving_mean, moving_var
+        for mean, var in zip(split_mean, split_var):
+            new_mean = new_mean * decay + mean * (1 - decay)
+            new_var = new_var * decay + var * (1 - decay)
+
+        with tf.control_dependencies([tf.assign(moving_mean, new_mean), tf.assign(moving_var, new_var)]):
+            x_norm = tf.nn.batch_normalization(x, batch_mean, batch_var, beta, gamma, epsilon)
+            x_norm = tf.reshape(x_norm, [bs, h, w, c])
+
+        return tf.cast(x_norm, dtype)
+
+
 def instance_norm(x, scope='instance_norm'):
-    return tf.contrib.layers.instance_norm(x,
-                                           epsilon=1e-05,
-                                           center=True, scale=True,
-                                           scope=scope)
+    x_norm = tf.contrib.layers.instance_norm(tf.cast(x, tf.float32),
+                                             epsilon=1e-05,
+                                             center=True, scale=True,
+                                             scope=scope)
+
+    return tf.cast(x_norm, x.dtype)
 
 
 def layer_norm(x, scope='layer_norm'):
-    return tf.contrib.layers.layer_norm(x,
-                                        center=True, scale=True,
-                                        scope=scope)
+    x_norm = tf.contrib.layers.layer_norm(tf.cast(x, tf.float32),
+                                          center=True, scale=True,
+                                          scope=scope)
+
+    return tf.cast(x_norm, x.dtype)
 
 
 def group_norm(x, groups=32, scope='group_norm'):
-    return tf.contrib.layers.group_norm(x, groups=groups, epsilon=1e-05,
-                                        center=True, scale=True,
-                                        scope=scope)
+    x_norm = tf.contrib.layers.group_norm(tf.cast(x, tf.float32), groups=groups, epsilon=1e-05,
+                                          center=True, scale=True,
+                                          scope=scope)
+
+    return tf.cast(x_norm, x.dtype)
 
 
 def adaptive_instance_norm(content, gamma, beta, epsilon=1e-5):
@@ -811,34 +993,81 @@ def regularization_loss(scope_name) :
 
     return tf.reduce_sum(loss)
 
-def histogram_loss(x, y):
-    histogram_x = get_histogram(x)
-    histogram_y = get_histogram(y)
+def histogram_loss(x, y, bins=10, per_image=False):
+    # y : images, or a histogram already computed from them (e.g. cached_histogram of the real data)
+    histogram_x = get_histogram(x, bins, per_image)
+
+    if len(y.get_shape()) == 4 :
+        histogram_y = get_histogram(y, bins, per_image)
+    else :
+        histogram_y = y
 
     hist_loss = L1_loss(histogram_x, histogram_y)
 
     return hist_loss
 
-def get_histogram(img, bin_size=0.2):
-    hist_entries = []
+def get_histogram(img, bins=10, per_image=False):
+    """
+    one bucketize + segment sum over the whole batch, bins of 2 / bins on (-1, 1] for every channel
+    per_image=False : [channels * bins], per_image=True : [bs, channels * bins]
+    """
+    bs, _, _, channels = img.get_shape().as_list()
+
+    img = tf.reshape(tf.cast(img, tf.float32), [bs, -1, channels])
 
-    img_r, img_g, img_b = tf.split(img, num_or_size_splits=3, axis=-1)
+    # the np.arange edges of the former compare loop, e.g. its 0 edge is -2.2e-16 so 0 falls in the bin above it
+    bin_size = 2.0 / bins
+    lower = np.arange(-1, 1, bin_size)[:bins]
+    upper = lower + bin_size
 
-    for img_chan in [img_r, img_g, img_b]:
-        for i in np.arange(-1, 1, bin_size):
-            gt = tf.greater(img_chan, i)
-            leq = tf.less_equal(img_chan, i + bin_size)
+    # (lower, upper] -> index of the bin, values outside (-1, 1] are invalid and dropped by the segment sum
+    bin_index = tf.reduce_sum(tf.cast(tf.expand_dims(img, -1) > lower.astype(np.float32), tf.int32), axis=-1) - 1
+    valid = tf.logical_and(bin_index >= 0, img <= tf.gather(upper.astype(np.float32), tf.maximum(bin_index, 0)))
 
-            condition = tf.cast(tf.logical_and(gt, leq), tf.float32)
-            hist_entries.append(tf.reduce_sum(condition))
+    segment = bin_index + tf.range(channels) * bins
+    if per_image :
+        segment = segment + tf.reshape(tf.range(bs), [bs, 1, 1]) * (channels * bins)
+        num_segments = bs * channels * bins
+    else :
+        num_segments = channels * bins
 
-    hist = normalization(hist_entries)
+    segment = tf.where(valid, segment, -tf.ones_like(segment))
+
+    hist = tf.unsorted_segment_sum(tf.ones_like(img), segment, num_segments)
+
+    if per_image :
+        hist = tf.reshape(hist, [bs, channels * bins])
+
+    hist = normalization(hist)
 
     return hist
 
+def cached_histogram(y, bins=10, per_image=False, scope='real_histogram'):
+    """
+    running mean of get_histogram(y) in local variables
+    run update once per real batch before training (or a few times), then pass hist to histogram_loss as y
+    so each step only computes the fake side
+    """
+    with tf.variable_scope(scope):
+        histogram_y = get_histogram(y, bins, per_image)
+
+        hist_sum = tf.get_variable('sum', shape=histogram_y.shape, initializer=tf.zeros_initializer(),
+                                   trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+        count = tf.get_variable('count', shape=[], initializer=tf.zeros_initializer(),
+                                trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+        update = tf.group(tf.assign_add(hist_sum, histogram_y), tf.assign_add(count, 1.0))
+        hist = tf.stop_gradient(hist_sum / tf.maximum(count, 1.0))
+
+        return hist, update
+
 
 def normalization(x):
-    x = (x - tf.reduce_min(x)) / (tf.reduce_max(x) - tf.reduce_min(x))
+    # min-max over the last axis, per image for per_image histograms
+    x_min = tf.reduce_min(x, axis=-1, keepdims=True)
+    x_max = tf.reduce_max(x, axis=-1, keepdims=True)
+
+    x = (x - x_min) / (x_max - x_min)
     return x
 
 def gram_matrix(x) :
@@ -1033,6 +1262,13 @@ def simple_gp(real_logit, fake_logit, real_images, fake_images, r1_gamma=10, r2_
 
     return r1_penalty + r2_penalty
 
+def lazy_regularization_adam(learning_rate, beta1, beta2, interval):
+    # StyleGAN2 : a penalty update every interval loss updates gives interval + 1 Adam steps where there were interval,
+    # lr and betas are rescaled by interval / (interval + 1) so the optimizer keeps its step size and momentum horizon
+    ratio = interval / (interval + 1.0)
+
+    return tf.train.AdamOptimizer(learning_rate * ratio, beta1=beta1 ** ratio, beta2=beta2 ** ratio)
+
 
 ##################################################################################
 # KL-Divergence Loss Function
@@ -0,0 +1,70 @@
+import os
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'contrib') :
+    pytest.skip('the model needs tensorflow 1.x with tf.contrib', allow_module_level=True)
+
+from main import parse_args
+from networks import DCGAN
+from ops import lazy_regularization_adam
+
+
+def build_args(tmp_path, *flags):
+    return parse_args(['--phase', 'train', '--synthetic', 'True', '--img_size', '32', '--batch_size', '2', '--ch', '16',
+                       '--checkpoint_dir', str(tmp_path / 'checkpoint'), '--result_dir', str(tmp_path / 'results'),
+                       '--log_dir', str(tmp_path / 'logs'), '--sample_dir', str(tmp_path / 'samples')] + list(flags))
+
+@pytest.mark.parametrize('flags', [[], ['--joint_d', 'True', '--sn', 'True'], ['--gan_type', 'wgan-gp', '--reg_every', '4']])
+def test_build_model(tmp_path, flags):
+    args = build_args(tmp_path, *flags)
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        gan = DCGAN(sess, args)
+        gan.build_model()
+
+        assert gan.fake_images.get_shape().as_list() == [2, 32, 32, 3]
+
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        sess.run(gan.stage_inputs)
+        sess.run([gan.d_step])
+        sess.run([gan.g_optim])
+
+        images = sess.run(gan.fake_images)
+        assert images.min() >= -1.0 and images.max() <= 1.0
+
+        gan.image_writer.close()
+
+def test_lazy_regularization_adam():
+    # (w - 2)^2 / 2 loss with a w^2 / 2 penalty, optimum at w = 1
+    # eager : Adam on loss + penalty every step, lazy : the penalty scaled by k on its own every k steps
+    k, steps = 4, 2000
+    with tf.Graph().as_default(), tf.Session() as sess:
+        w_eager = tf.Variable(3.0)
+        w_lazy = tf.Variable(3.0)
+        w_unscaled = tf.Variable(3.0)
+
+        loss = lambda w: 0.5 * tf.square(w - 2.0)
+        reg = lambda w: 0.5 * tf.square(w)
+
+        eager = tf.train.AdamOptimizer(0.01, beta1=0.5, beta2=0.99).minimize(loss(w_eager) + reg(w_eager))
+
+        lazy_optimizer = lazy_regularization_adam(0.01, 0.5, 0.99, k)
+        lazy, lazy_reg = lazy_optimizer.minimize(loss(w_lazy)), lazy_optimizer.minimize(reg(w_lazy) * k)
+
+        unscaled_optimizer = lazy_regularization_adam(0.01, 0.5, 0.99, k)
+        unscaled, unscaled_reg = unscaled_optimizer.minimize(loss(w_unscaled)), unscaled_optimizer.minimize(reg(w_unscaled))
+
+        sess.run(tf.global_variables_initializer())
+        for step in range(1, steps + 1):
+            sess.run([eager, lazy, unscaled])
+            if step % k == 0 :
+                sess.run([lazy_reg, unscaled_reg])
+
+        w_eager, w_lazy, w_unscaled = sess.run([w_eager, w_lazy, w_unscaled])
+
+    assert abs(w_eager - 1.0) < 1e-2
+    assert abs(w_lazy - 1.0) < 1e-2
+
+    # without the k scale the penalty is a quarter as strong, optimum at w = 1.6
+    assert abs(w_unscaled - 1.6) < 1e-2
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'contrib') :
+    pytest.skip('ops.py needs tensorflow 1.x with tf.contrib', allow_module_level=True)
+
+from ops import self_attention, self_attention_with_pooling, global_context_block, get_histogram, cached_histogram
+
+
+def dense_and_blocked(layer, block_size):
+    # same variables, dense path first, blocked path with reuse : forward outputs and gradients of both
+    x = tf.constant(np.random.RandomState(0).normal(size=[2, 6, 6, 16]).astype(np.float32))
+    weights = tf.constant(np.random.RandomState(1).normal(size=[2, 6, 6, 16]).astype(np.float32))
+
+    results = []
+    for reuse, size in [(False, 0), (True, block_size)]:
+        with tf.variable_scope('layer', reuse=reuse):
+            y = layer(x, 16, block_size=size)
+
+        loss = tf.reduce_sum(y * weights)
+        results.append([y] + tf.gradients(loss, [x] + tf.trainable_variables()))
+
+    return results
+
+# N = 6 * 6 = 36 keys, 9 after the pooling : no block size below divides them, the padded keys are masked
+@pytest.mark.parametrize('layer, block_size', [(self_attention, 16), (self_attention_with_pooling, 4), (global_context_block, 16)])
+def test_blocked_attention_matches_dense(layer, block_size):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        dense, blocked = dense_and_blocked(layer, block_size)
+
+        sess.run(tf.global_variables_initializer())
+
+        # gamma starts at 0, which would hide the attention output
+        for var in tf.global_variables():
+            if var.op.name.endswith('gamma') :
+                var.load(np.ones(var.shape.as_list(), dtype=np.float32), sess)
+
+        dense, blocked = sess.run([dense, blocked])
+
+    for a, b in zip(dense, blocked):
+        np.testing.assert_allclose(a, b, rtol=1e-4, atol=1e-4)
+
+def loop_histogram(img, bin_size=0.2):
+    # the 3 x 10 compare loop get_histogram replaced, with its global min-max normalization
+    hist_entries = []
+    img_r, img_g, img_b = tf.split(img, num_or_size_splits=3, axis=-1)
+    for img_chan in [img_r, img_g, img_b]:
+        for i in np.arange(-1, 1, bin_size):
+            gt = tf.greater(img_chan, i)
+            leq = tf.less_equal(img_chan, i + bin_size)
+            condition = tf.cast(tf.logical_and(gt, leq), tf.float32)
+            hist_entries.append(tf.reduce_sum(condition))
+
+    x = tf.stack(hist_entries)
+    return (x - tf.reduce_min(x)) / (tf.reduce_max(x) - tf.reduce_min(x))
+
+def histogram_images(seed):
+    # bin edges and the ends of the range, -1 falls outside (-1, 1] in both versions
+    state = np.random.RandomState(seed)
+    images = state.uniform(-1.0, 1.0, size=[2, 4, 4, 3])
+    images.reshape(-1)[:24] = state.choice([-1.0, -0.8, 1.0, -0.4, 0.0, 0.6], size=24)
+
+    return tf.constant(images.astype(np.float32))
+
+@pytest.mark.parametrize('per_image', [False, True])
+def test_get_histogram_matches_loop(per_image):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        images = histogram_images(0)
+
+        hist = get_histogram(images, bins=10, per_image=per_image)
+        if per_image :
+            reference = tf.stack([loop_histogram(images[i:i + 1]) for i in range(2)])
+        else :
+            reference = loop_histogram(images)
+
+        hist, reference = sess.run([hist, reference])
+
+    np.testing.assert_allclose(hist, reference, atol=1e-6)
+
+@pytest.mark.parametrize('per_image', [False, True])
+def test_cached_histogram_matches_loop(per_image):
+    with tf.Graph().as_default(), tf.Session() as sess:
+        batches = [histogram_images(seed) for seed in range(3)]
+        batch = tf.placeholder(tf.float32, [2, 4, 4, 3])
+
+        hist, update = cached_histogram(batch, bins=10, per_image=per_image)
+
+        references = []
+        for images in batches:
+            if per_image :
+                references.append(tf.stack([loop_histogram(images[i:i + 1]) for i in range(2)]))
+            else :
+                references.append(loop_histogram(images))
+
+        sess.run(tf.local_variables_initializer())
+        for images in sess.run(batches):
+            sess.run(update, feed_dict={batch: images})
+
+        hist, references = sess.run([hist, references])
+
+    np.testing.assert_allclose(hist, np.mean(references, axis=0), atol=1e-6)
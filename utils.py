@@ -0,0 +1,1498 @@
+import tensorflow as tf
+import numpy as np
+import random, os, re, struct, time, zlib
+import atexit, hashlib, json, multiprocessing, queue, threading
+from glob import glob
+from tensorflow.python.client import timeline
+from tensorflow.python.framework import tensor_util
+import cv2
+
+class ImageData:
+
+    def __init__(self, img_height, img_width, channels, augment_flag, cache=None, batch_augment=False, scaled_decode=False):
+        self.img_height = img_height
+        self.img_width = img_width
+        self.channels = channels
+        self.augment_flag = augment_flag
+
+        # batch_augment : the map functions only decode, augment_batch runs on whole batches later
+        self.batch_augment = batch_augment
+
+        # scaled_decode : jpegs are downscaled by 2, 4 or 8 inside the decoder, see decode_jpeg_scaled
+        self.scaled_decode = scaled_decode
+
+        # uint8 [N, h, w, c] memmap from load_image_cache, indexed by cache_processing
+        self.cache = cache
+
+    def image_processing(self, filename):
+        x = tf.read_file(filename)
+
+        return self.decode_processing(x)
+
+    def record_processing(self, serialized):
+        # one tf.train.Example of a shard written by write_shards
+        features = tf.parse_single_example(serialized, features={'image': tf.FixedLenFeature([], tf.string)})
+
+        return self.decode_processing(features['image'])
+
+    def decode_processing(self, x):
+        if self.scaled_decode :
+            x_decode = self.decode_jpeg_scaled(x)
+        else :
+            x_decode = tf.image.decode_jpeg(x, channels=self.channels, dct_method='INTEGER_ACCURATE')
+        img = tf.image.resize_images(x_decode, [self.img_height, self.img_width])
+        img = tf.cast(img, tf.float32) / 127.5 - 1
+
+        if self.augment_flag and not self.batch_augment :
+            img = self.augment(img)
+
+        return img
+
+    def decode_jpeg_scaled(self, contents):
+        """
+        the largest DCT-domain ratio (8, 4, 2 or 1) that still keeps both sides >= the target size, read from the jpeg header
+        only that decode runs, the final resize_images then works on a few times the target pixels
+        that resize runs in float32 like the full decode path : the bilinear kernels of tf 1.x always return float,
+        only nearest neighbour stays uint8 and it aliases on the remaining < 2x downscale
+        """
+        shape = tf.image.extract_jpeg_shape(contents)
+        scale = tf.minimum(shape[0] // self.img_height, shape[1] // self.img_width)
+
+        def decode(ratio):
+            return lambda: tf.image.decode_jpeg(contents, channels=self.channels, ratio=ratio, dct_method='INTEGER_ACCURATE')
+
+        x_decode = tf.case([(scale >= 8, decode(8)), (scale >= 4, decode(4)), (scale >= 2, decode(2))],
+                           default=decode(1), exclusive=False)
+        x_decode.set_shape([None, None, self.channels])
+
+        return x_decode
+
+    def cache_processing(self, index):
+        # index : [bs] int64, gathered from the memmap in one read (sorted for locality)
+        def gather(idx) :
+            return self.cache[np.sort(idx)]
+
+        img = tf.py_func(gather, [index], tf.uint8, stateful=False)
+        img.set_shape([None, self.img_height, self.img_width, self.channels])
+        img = tf.cast(img, tf.float32) / 127.5 - 1
+
+        if self.augment_flag and not self.batch_augment :
+            img = tf.map_fn(self.augment, img)
+
+        return img
+
+    def augment(self, img):
+        augment_height = self.img_height + (30 if self.img_height == 256 else int(self.img_height * 0.1))
+        augment_width = self.img_width + (30 if self.img_width == 256 else int(self.img_width * 0.1))
+
+        img = tf.cond(pred=tf.greater_equal(tf.random_uniform(shape=[], minval=0.0, maxval=1.0), 0.5),
+                      true_fn=lambda: augmentation(img, augment_height, augment_width),
+                      false_fn=lambda: img)
+
+        return img
+
+    def augment_batch(self, img):
+        """
+        augment for a [bs, h, w, c] batch in a few batched ops, same distribution as augment per image :
+        half of the images are augmented, those are flipped with probability 0.5, upsized and randomly cropped
+        """
+        if not self.augment_flag :
+            return img
+
+        bs = tf.shape(img)[0]
+        augment_height = self.img_height + (30 if self.img_height == 256 else int(self.img_height * 0.1))
+        augment_width = self.img_width + (30 if self.img_width == 256 else int(self.img_width * 0.1))
+
+        augment_mask = tf.greater_equal(tf.random_uniform(shape=[bs], minval=0.0, maxval=1.0), 0.5)
+        flip_mask = tf.less(tf.random_uniform(shape=[bs], minval=0.0, maxval=1.0), 0.5)
+
+        x = tf.where(flip_mask, tf.reverse(img, axis=[2]), img)
+        x = tf.image.resize_images(x, [augment_height, augment_width])
+
+        # integer crop offsets as boxes : crop_and_resize samples exact pixels of the upsized batch
+        offset_y = tf.cast(tf.random_uniform(shape=[bs], maxval=augment_height - self.img_height + 1, dtype=tf.int32), tf.float32)
+        offset_x = tf.cast(tf.random_uniform(shape=[bs], maxval=augment_width - self.img_width + 1, dtype=tf.int32), tf.float32)
+
+        boxes = tf.stack([offset_y / (augment_height - 1), offset_x / (augment_width - 1),
+                          (offset_y + self.img_height - 1) / (augment_height - 1),
+                          (offset_x + self.img_width - 1) / (augment_width - 1)], axis=1)
+        x = tf.image.crop_and_resize(x, boxes, tf.range(bs), [self.img_height, self.img_width])
+
+        img = tf.where(augment_mask, x, img)
+
+        return img
+
+def decode_quality_report(data, img_height, img_width, channels, num=64):
+    """ Full decode against scaled_decode on the first num images : PSNR of the training inputs and decode time
+        both paths end in the same float32 bilinear resize, the difference is the DCT-domain downscale alone """
+    data = list(data)[:num]
+    if not data :
+        return {}
+
+    with tf.Graph().as_default():
+        filename = tf.placeholder(tf.string, shape=[])
+        full = ImageData(img_height, img_width, channels, False).image_processing(filename)
+        scaled = ImageData(img_height, img_width, channels, False, scaled_decode=True).image_processing(filename)
+
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            sess.run([full, scaled], feed_dict={filename: data[0]})
+
+            psnr, full_time, scaled_time = [], 0.0, 0.0
+            for image_path in data:
+                start = time.time()
+                x = sess.run(full, feed_dict={filename: image_path})
+                full_time += time.time() - start
+
+                start = time.time()
+                y = sess.run(scaled, feed_dict={filename: image_path})
+                scaled_time += time.time() - start
+
+                mse = np.mean(np.square((x - y) * 127.5))
+                psnr.append(10 * np.log10(255.0 ** 2 / max(mse, 1e-10)))
+
+    report = {'images': len(data), 'psnr_mean': float(np.mean(psnr)), 'psnr_min': float(np.min(psnr)),
+              'full_ms': full_time / len(data) * 1000.0, 'scaled_ms': scaled_time / len(data) * 1000.0}
+
+    print()
+    print("##### Scaled jpeg decode #####")
+    print("# images : ", report['images'])
+    print("# psnr against full decode : {:.2f} dB mean, {:.2f} dB min".format(report['psnr_mean'], report['psnr_min']))
+    print("# final resize : float32 bilinear on both paths, not uint8")
+    print("# decode + resize : {:.2f} ms full, {:.2f} ms scaled (x{:.1f})".format(
+        report['full_ms'], report['scaled_ms'], report['full_ms'] / max(report['scaled_ms'], 1e-9)))
+    print()
+
+    return report
+
+##################################################################################
+# Decoded image cache
+##################################################################################
+
+def image_cache_path(cache_dir, dataset_name, img_size, img_channel):
+    return os.path.join(cache_dir, '{}_{}_{}.npy'.format(dataset_name, img_size, img_channel))
+
+def decode_image(image_path, img_size, img_channel):
+    if img_channel == 1 :
+        img = cv2.imread(image_path, flags=cv2.IMREAD_GRAYSCALE)
+    else :
+        img = cv2.imread(image_path, flags=cv2.IMREAD_COLOR)
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    img = cv2.resize(img, dsize=(img_size, img_size), interpolation=cv2.INTER_LINEAR)
+
+    if img_channel == 1 :
+        img = np.expand_dims(img, axis=-1)
+
+    return img
+
+def image_cache_fingerprint(data):
+    """ sha1 of the sorted paths with their sizes and mtimes, the cache rows follow the sorted order """
+    digest = hashlib.sha1()
+    for image_path in sorted(data):
+        stat = os.stat(image_path)
+        digest.update('{}\t{}\t{}\n'.format(image_path, stat.st_size, stat.st_mtime).encode())
+
+    return digest.hexdigest()
+
+def build_image_cache(data, cache_path, img_size, img_channel, fingerprint=None):
+    """ Decode and resize every image (sorted by path) once into a uint8 [N, img_size, img_size, img_channel] .npy file """
+    check_folder(os.path.dirname(cache_path) or '.')
+    tmp_path = cache_path + '.tmp'
+    meta_path = cache_path + '.json'
+
+    # a cache without its fingerprint file never counts as valid, even if the build is interrupted
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    data = sorted(data)
+    cache = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                      shape=(len(data), img_size, img_size, img_channel))
+
+    for idx, image_path in enumerate(data):
+        cache[idx] = decode_image(image_path, img_size, img_channel)
+
+        if np.mod(idx + 1, 10000) == 0 :
+            print(" [*] Caching images... {}/{}".format(idx + 1, len(data)))
+
+    cache.flush()
+    del cache
+
+    # readers only ever see a complete file
+    os.replace(tmp_path, cache_path)
+
+    with open(meta_path, 'w') as f:
+        json.dump({'num_images': len(data), 'fingerprint': fingerprint or image_cache_fingerprint(data)}, f)
+
+def load_image_cache(data, cache_path, img_size, img_channel, build=True):
+    """
+    The memmap cache of data, rebuilt when the shape or the paths / sizes / mtimes of the files changed
+    build=False only reads : data parallel replicas use the cache the chief built before the session opened
+    """
+    fingerprint = image_cache_fingerprint(data)
+    meta_path = cache_path + '.json'
+
+    if os.path.exists(cache_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        cache = np.load(cache_path, mmap_mode='r')
+        if cache.shape == (len(data), img_size, img_size, img_channel) and meta['fingerprint'] == fingerprint :
+            print(" [*] Load image cache {}".format(cache_path))
+            return cache
+
+        print(" [!] Image cache {} is stale".format(cache_path))
+
+    if not build :
+        raise ValueError(" [!] Image cache {} is missing or stale, it is built by main.py before the session opens".format(cache_path))
+
+    print(" [*] Build image cache {}".format(cache_path))
+    build_image_cache(data, cache_path, img_size, img_channel, fingerprint)
+
+    return np.load(cache_path, mmap_mode='r')
+
+##################################################################################
+# Dataset manifest
+##################################################################################
+
+def manifest_path(dataset_name):
+    # next to the dataset directory, so load_data never lists it as an image
+    return os.path.join('./dataset', dataset_name + '_manifest.json')
+
+def validate_image(item):
+    """
+    (image_path, img_channel, repair_dir) -> manifest entry, run in a process pool
+    unreadable files are dropped, readable files that are not jpeg or have another channel count are re-encoded into repair_dir
+    """
+    image_path, img_channel, repair_dir = item
+    stat = os.stat(image_path)
+    entry = {'source': image_path, 'path': image_path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    with open(image_path, 'rb') as f:
+        contents = f.read()
+
+    img = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None :
+        entry['error'] = 'unreadable'
+        return entry
+
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    entry.update({'height': img.shape[0], 'width': img.shape[1], 'channels': channels,
+                  'md5': hashlib.md5(contents).hexdigest()})
+
+    if contents[:2] != b'\xff\xd8' or channels != img_channel :
+        flag = cv2.IMREAD_GRAYSCALE if img_channel == 1 else cv2.IMREAD_COLOR
+        repaired = cv2.imdecode(np.frombuffer(contents, np.uint8), flag)
+
+        entry['path'] = os.path.join(repair_dir, os.path.basename(image_path) + '.jpg')
+        entry['channels'] = img_channel
+        cv2.imwrite(entry['path'], repaired, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+    return entry
+
+def build_manifest(dataset_name, img_channel, num_workers=0):
+    """
+    paths, sizes, dimensions, channels and md5 of every image, validated in a process pool
+    an existing manifest is updated : only new or modified files are validated again, removed files are dropped
+    """
+    path = manifest_path(dataset_name)
+    repair_dir = check_folder(os.path.join('./dataset', dataset_name + '_repaired'))
+
+    old = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest['channels'] == img_channel :
+            old = {entry['source']: entry for entry in manifest['images'] + manifest['dropped']}
+
+    entries, todo = [], []
+    for image_path in sorted(load_data(dataset_name)):
+        entry = old.get(image_path)
+        stat = os.stat(image_path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime :
+            entries.append(entry)
+        else :
+            todo.append((image_path, img_channel, repair_dir))
+
+    print(" [*] Validating {} new or modified images, {} unchanged".format(len(todo), len(entries)))
+
+    if todo :
+        pool = multiprocessing.Pool(num_workers or available_cores())
+        try :
+            entries += pool.map(validate_image, todo, chunksize=64)
+        finally :
+            pool.close()
+            pool.join()
+
+    entries = sorted(entries, key=lambda entry: entry['source'])
+    manifest = {'dataset': dataset_name, 'channels': img_channel,
+                'images': [entry for entry in entries if 'error' not in entry],
+                'dropped': [entry for entry in entries if 'error' in entry]}
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+    repaired = sum(entry['path'] != entry['source'] for entry in manifest['images'])
+    print(" [*] Write {} : {} images, {} repaired, {} dropped".format(path, len(manifest['images']), repaired, len(manifest['dropped'])))
+    for entry in manifest['dropped']:
+        print(" [!] Dropped {} ({})".format(entry['source'], entry['error']))
+
+    return manifest
+
+def load_manifest(dataset_name, img_channel, update=False, num_workers=0, build=True):
+    """
+    Image paths from the manifest, built on first use or with update=True, without listing the dataset directory
+    build=False only reads : for processes that must not fork a pool (an open session) or race the chief writing it
+    """
+    path = manifest_path(dataset_name)
+
+    if update or not os.path.exists(path):
+        if not build :
+            raise ValueError(" [!] No manifest {}, it is built by main.py before the session opens".format(path))
+        return build_manifest(dataset_name, img_channel, num_workers)
+
+    manifest = read_manifest(path)
+
+    if manifest['channels'] != img_channel :
+        if not build :
+            raise ValueError(" [!] Manifest {} was built for {} channels, not {}".format(path, manifest['channels'], img_channel))
+        print(" [!] Manifest {} was built for {} channels, rebuilding".format(path, manifest['channels']))
+        return build_manifest(dataset_name, img_channel, num_workers)
+
+    return manifest
+
+def dataset_paths(dataset_name, img_channel, use_manifest=True, path='', update=False, build=True):
+    """ Training image paths : an explicit manifest (e.g. from dedup.py), the dataset manifest, or a directory listing """
+    if path :
+        return [entry['path'] for entry in read_manifest(path)['images']]
+
+    if use_manifest :
+        return [entry['path'] for entry in load_manifest(dataset_name, img_channel, update=update, build=build)['images']]
+
+    return load_data(dataset_name)
+
+def read_manifest(path):
+    # any manifest file as written by build_manifest or dedup.py
+    with open(path) as f:
+        manifest = json.load(f)
+
+    print(" [*] Load manifest {} : {} images".format(path, len(manifest['images'])))
+
+    return manifest
+
+##################################################################################
+# Deduplication
+##################################################################################
+
+def perceptual_hash(item):
+    """
+    (image_path, height, width) -> 64 bit DCT hash, run in a process pool
+    large images are decoded at reduced scale, only a 32x32 gray version is needed
+    """
+    image_path, height, width = item
+    side = min(height, width)
+    flag = cv2.IMREAD_REDUCED_GRAYSCALE_8 if side >= 1024 else cv2.IMREAD_REDUCED_GRAYSCALE_4 if side >= 512 else \
+        cv2.IMREAD_REDUCED_GRAYSCALE_2 if side >= 256 else cv2.IMREAD_GRAYSCALE
+
+    img = cv2.imread(image_path, flags=flag)
+    img = cv2.resize(img, dsize=(32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    # lowest 8x8 frequencies against their median, the dc term excluded from the median
+    dct = cv2.dct(img)[:8, :8].flatten()
+    bits = dct > np.median(dct[1:])
+
+    return int(np.packbits(bits).view('>u8')[0])
+
+def popcount64(x):
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+def near_duplicate_pairs(hashes, threshold=4, block=2048):
+    """
+    multi-index hashing : the 64 bits are cut into threshold + 1 chunks, two hashes within threshold bits
+    agree exactly on at least one chunk (pigeonhole), so only hashes sharing a chunk value are compared
+    hashes : uint64 [N] -> int64 [P, 2] index pairs (i < j) with hamming distance <= threshold
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    num_chunks = threshold + 1
+    bounds = np.linspace(0, 64, num_chunks + 1).astype(np.int64)
+
+    pairs = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        key = (hashes >> np.uint64(start)) & np.uint64((1 << int(end - start)) - 1)
+
+        # groups of equal chunk value as runs of the sorted keys
+        order = np.argsort(key, kind='stable')
+        splits = np.flatnonzero(np.diff(key[order])) + 1
+
+        for group in np.split(order, splits):
+            if len(group) < 2 :
+                continue
+
+            group = np.sort(group)
+            for i in range(0, len(group), block):
+                rows = group[i:i + block]
+                distance = popcount64(hashes[rows][:, None] ^ hashes[group][None, :])
+                r, c = np.nonzero((distance <= threshold) & (rows[:, None] < group[None, :]))
+                pairs.append(np.stack([rows[r], group[c]], axis=1))
+
+    if not pairs :
+        return np.zeros([0, 2], dtype=np.int64)
+
+    return np.unique(np.concatenate(pairs).astype(np.int64), axis=0)
+
+def duplicate_clusters(pairs, num_images):
+    # union-find over the pairs, cluster id = root index
+    parent = np.arange(num_images)
+
+    def find(i):
+        root = i
+        while parent[root] != root :
+            root = parent[root]
+        while parent[i] != root :
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j :
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    return np.array([find(i) for i in range(num_images)])
+
+def dedup_manifest(manifest, threshold=4, num_workers=0):
+    """ Manifest keeping the largest image of every near-duplicate cluster, the others listed under duplicates """
+    images = manifest['images']
+
+    pool = multiprocessing.Pool(num_workers or available_cores())
+    try :
+        hashes = pool.map(perceptual_hash, [(entry['path'], entry['height'], entry['width']) for entry in images], chunksize=256)
+    finally :
+        pool.close()
+        pool.join()
+
+    hashes = np.array(hashes, dtype=np.uint64)
+    pairs = near_duplicate_pairs(hashes, threshold)
+    clusters = duplicate_clusters(pairs, len(images))
+
+    # the largest resolution of each cluster is kept, the first path on ties
+    keep = {}
+    for idx, cluster in enumerate(clusters):
+        size = images[idx]['height'] * images[idx]['width']
+        if cluster not in keep or size > images[keep[cluster]]['height'] * images[keep[cluster]]['width'] :
+            keep[cluster] = idx
+
+    kept, duplicates = [], []
+    for idx, (entry, cluster) in enumerate(zip(images, clusters)):
+        entry = dict(entry, phash='{:016x}'.format(int(hashes[idx])))
+        if keep[cluster] == idx :
+            kept.append(entry)
+        else :
+            duplicates.append(dict(entry, duplicate_of=images[keep[cluster]]['path']))
+
+    print()
+    print("##### Deduplication #####")
+    print("# images : ", len(images))
+    print("# near-duplicate pairs (<= {} bits) : {}".format(threshold, len(pairs)))
+    print("# kept : ", len(kept))
+    print("# removed : ", len(duplicates))
+    print()
+
+    return dict(manifest, images=kept, duplicates=duplicates, dedup_threshold=threshold)
+
+##################################################################################
+# Sharded archive
+##################################################################################
+
+compression_types = {'': tf.python_io.TFRecordCompressionType.NONE,
+                     'GZIP': tf.python_io.TFRecordCompressionType.GZIP,
+                     'ZLIB': tf.python_io.TFRecordCompressionType.ZLIB}
+
+def shard_meta_path(shard_dir, dataset_name):
+    return os.path.join(shard_dir, dataset_name, 'shards.json')
+
+def write_shards(data, shard_dir, dataset_name, shard_mb=256, compression=''):
+    """ Pack the encoded image files into TFRecord shards of about shard_mb, shards.json is written last """
+    out_dir = check_folder(os.path.join(shard_dir, dataset_name))
+    options = tf.python_io.TFRecordOptions(compression_types[compression])
+    suffix = '.tfrecord' + ('.' + compression.lower() if compression else '')
+
+    shards, writer, shard_bytes = [], None, 0
+    for idx, image_path in enumerate(data):
+        if writer is None or shard_bytes >= shard_mb * 1024 * 1024 :
+            if writer is not None :
+                writer.close()
+
+            shards.append('{}-{:05d}{}'.format(dataset_name, len(shards), suffix))
+            writer = tf.python_io.TFRecordWriter(os.path.join(out_dir, shards[-1]), options=options)
+            shard_bytes = 0
+
+        with open(image_path, 'rb') as f:
+            contents = f.read()
+
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[contents])),
+            'name': tf.train.Feature(bytes_list=tf.train.BytesList(value=[os.path.basename(image_path).encode()]))}))
+
+        writer.write(example.SerializeToString())
+        shard_bytes += len(contents)
+
+        if np.mod(idx + 1, 10000) == 0 :
+            print(" [*] Writing shards... {}/{}".format(idx + 1, len(data)))
+
+    if writer is not None :
+        writer.close()
+
+    meta = {'num_images': len(data), 'shards': shards, 'compression': compression}
+    with open(shard_meta_path(shard_dir, dataset_name), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print(" [*] Write {} images into {} shards in {}".format(len(data), len(shards), out_dir))
+
+    return meta
+
+def load_shards(shard_dir, dataset_name):
+    meta_path = shard_meta_path(shard_dir, dataset_name)
+    if not os.path.exists(meta_path):
+        raise ValueError(" [!] No shards for {} in {}, run make_shards.py --dataset {} --shard_dir {} first".format(
+            dataset_name, shard_dir, dataset_name, shard_dir))
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    meta['shards'] = [os.path.join(shard_dir, dataset_name, shard) for shard in meta['shards']]
+    print(" [*] Load {} shards, {} images".format(len(meta['shards']), meta['num_images']))
+
+    return meta
+
+def build_shard_dataset(shard_files, compression, cycle_length, num_shards=1, shard_index=0):
+    """
+    serialized records read sequentially from cycle_length shards at once, shard order reshuffled every pass
+    the per-record shuffle is left to the bounded buffer of build_input_pipeline
+    """
+    from tensorflow.contrib.data import parallel_interleave  # tf.contrib loads slowly, only when a pipeline is built
+
+    files = tf.data.Dataset.from_tensor_slices(shard_files)
+
+    if num_shards > 1 :
+        # data parallel replicas read disjoint shards
+        if len(shard_files) < num_shards :
+            print(" [!] {} shards for {} replicas, some replicas read nothing".format(len(shard_files), num_shards))
+        files = files.shard(num_shards, shard_index)
+
+    files = files.shuffle(len(shard_files))
+    records = files.apply(parallel_interleave(
+        lambda filename: tf.data.TFRecordDataset(filename, compression_type=compression, buffer_size=8 * 1024 * 1024),
+        cycle_length=cycle_length, sloppy=True))
+
+    return records
+
+##################################################################################
+# Input pipeline
+##################################################################################
+
+def available_cores():
+    try :
+        return len(os.sched_getaffinity(0))
+    except AttributeError :
+        return os.cpu_count() or 1
+
+def gpus_expected(device='auto'):
+    """ Whether training runs on gpus, from --device and the environment, without creating any device """
+    if device != 'auto' :
+        return 'GPU' in device.upper()
+
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible is not None and visible.strip() in ['', '-1'] :
+        return False
+
+    return tf.test.is_built_with_cuda()
+
+def pick_device(device='auto', sess=None):
+    if device != 'auto' :
+        return device
+
+    # the devices of the open session respect its visible_device_list and claim no extra gpu memory,
+    # device_lib.list_local_devices() would initialize every visible gpu
+    if sess is not None :
+        gpus = [d.name for d in sess.list_devices() if d.device_type == 'GPU']
+        return gpus[0] if gpus else '/cpu:0'
+
+    return '/gpu:0' if gpus_expected(device) else '/cpu:0'
+
+def input_pipeline_config(batch_size, img_size, img_channel, device='auto', num_parallel_calls=0, prefetch_mb=256,
+                          local_replicas=1, sess=None):
+    """ Choose the prefetch device, map parallelism and prefetch depth (in batches) for this machine """
+    # data parallel replicas on the same box split the cores between them
+    cores = max(available_cores() // local_replicas, 1)
+    device = pick_device(device, sess)
+
+    if num_parallel_calls <= 0 :
+        # leave one core for the training step itself when it runs on the cpu
+        num_parallel_calls = cores if 'GPU' in device.upper() else max(cores - 1, 1)
+
+    batch_mb = batch_size * img_size * img_size * img_channel * 4 / (1024.0 * 1024.0)
+    prefetch_batches = int(max(1, min(prefetch_mb // max(batch_mb, 1e-8), num_parallel_calls)))
+
+    config = {
+        'device': device,
+        'cores': cores,
+        'num_parallel_calls': num_parallel_calls,
+        'prefetch_batches': prefetch_batches,
+        'batch_mb': batch_mb,
+        'prefetch_mb': prefetch_mb
+    }
+
+    print("##### Input pipeline #####")
+    print("# device : ", config['device'])
+    print("# cpu cores : ", config['cores'])
+    print("# num_parallel_calls : ", config['num_parallel_calls'])
+    print("# prefetch batches : {} ({:.1f} MB of {} MB budget)".format(prefetch_batches, prefetch_batches * batch_mb, prefetch_mb))
+    print()
+
+    return config
+
+def build_input_pipeline(inputs, map_func, batch_size, buffer_size, config, map_after_batch=False,
+                         num_shards=1, shard_index=0, batch_func=None):
+    from tensorflow.contrib.data import prefetch_to_device, shuffle_and_repeat, map_and_batch  # loaded on first pipeline
+
+    if num_shards > 1 :
+        # every data parallel replica reads its own disjoint part of the dataset
+        inputs = inputs.shard(num_shards, shard_index)
+        buffer_size = max(buffer_size // num_shards, 1)
+
+    inputs = inputs.apply(shuffle_and_repeat(buffer_size))
+
+    if map_after_batch :
+        inputs = inputs.\
+            batch(batch_size, drop_remainder=True).\
+            map(map_func, num_parallel_calls=config['num_parallel_calls'])
+    else :
+        inputs = inputs.apply(map_and_batch(map_func, batch_size,
+                                            num_parallel_calls=config['num_parallel_calls'], drop_remainder=True))
+
+    if batch_func is not None :
+        # whole-batch ops, e.g. ImageData.augment_batch
+        inputs = inputs.map(batch_func, num_parallel_calls=config['num_parallel_calls'])
+
+    if 'GPU' in config['device'].upper() :
+        inputs = inputs.apply(prefetch_to_device(config['device'], config['prefetch_batches']))
+    else :
+        inputs = inputs.prefetch(config['prefetch_batches'])
+
+    return inputs
+
+def load_data(dataset_name):
+    x = glob(os.path.join('./dataset', dataset_name, '*.*'))
+
+    return x
+
+def load_test_image(image_path, img_width, img_height, img_channel):
+
+    if img_channel == 1 :
+        img = cv2.imread(image_path, flags=cv2.IMREAD_GRAYSCALE)
+    else :
+        img = cv2.imread(image_path, flags=cv2.IMREAD_COLOR)
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    img = cv2.resize(img, dsize=(img_width, img_height))
+
+    if img_channel == 1 :
+        img = np.expand_dims(img, axis=0)
+        img = np.expand_dims(img, axis=-1)
+    else :
+        img = np.expand_dims(img, axis=0)
+
+    img = img/127.5 - 1
+
+    return img
+
+def augmentation(image, augment_height, augment_width):
+    seed = random.randint(0, 2 ** 31 - 1)
+    ori_image_shape = tf.shape(image)
+    image = tf.image.random_flip_left_right(image, seed=seed)
+    image = tf.image.resize_images(image, [augment_height, augment_width])
+    image = tf.random_crop(image, ori_image_shape, seed=seed)
+    return image
+
+def save_images(images, size, image_path, stream=None):
+    return imsave(inverse_transform(images), size, image_path, stream=stream)
+
+def inverse_transform(images):
+    return ((images+1.) / 2) * 255.0
+
+# sample grids larger than this are written in row strips instead of one canvas
+STREAM_CANVAS_BYTES = 256 * 1024 * 1024
+
+def to_uint8(images):
+    return np.clip(images, 0, 255).astype(np.uint8)
+
+def imsave(images, size, path, stream=None):
+    images = to_uint8(images)
+
+    if stream is None :
+        h, w, c = images.shape[1:]
+        stream = h * size[0] * w * size[1] * c > STREAM_CANVAS_BYTES
+
+    if stream :
+        return imsave_strips(images, size, path)
+
+    images = merge(images, size)
+
+    if images.shape[-1] == 3 :
+        images = cv2.cvtColor(images, cv2.COLOR_RGB2BGR)
+
+    return cv2.imwrite(path, images)
+
+def merge(images, size):
+    # [n, h, w, c] -> [rows * h, cols * w, c] with one reshape/transpose, missing cells stay black
+    images = pad_grid(images, size[0] * size[1])
+    _, h, w, c = images.shape
+
+    img = images.reshape(size[0], size[1], h, w, c).transpose(0, 2, 1, 3, 4)
+
+    return img.reshape(size[0] * h, size[1] * w, c)
+
+def pad_grid(images, num):
+    images = images[:num]
+    if len(images) < num :
+        pad = np.zeros((num - len(images),) + images.shape[1:], dtype=images.dtype)
+        images = np.concatenate([images, pad], axis=0)
+
+    return images
+
+def imsave_strips(images, size, path):
+    """ Stream a uint8 grid to PNG one row of tiles at a time, peak memory is a single strip """
+    _, h, w, c = images.shape
+    height, width = size[0] * h, size[1] * w
+    color_type = {1: 0, 3: 2, 4: 6}[c]
+
+    def chunk(f, tag, data):
+        f.write(struct.pack('>I', len(data)))
+        f.write(tag + data)
+        f.write(struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    compressor = zlib.compressobj(6)
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+        for row in range(size[0]):
+            strip = pad_grid(images[row * size[1]:], size[1])
+            strip = strip.transpose(1, 0, 2, 3).reshape(h, width * c)
+
+            # every png scanline starts with its filter type (0 = none)
+            scanlines = np.concatenate([np.zeros((h, 1), dtype=np.uint8), strip], axis=1)
+            data = compressor.compress(scanlines.tobytes())
+            if data :
+                chunk(f, b'IDAT', data)
+
+        chunk(f, b'IDAT', compressor.flush())
+        chunk(f, b'IEND', b'')
+
+    return True
+
+class ImageWriter:
+    """
+    Bounded pool of threads running save_images, so png encoding never blocks the training step
+    the first failed write is raised by the next save_images, flush or close
+    """
+
+    def __init__(self, num_workers=2, max_queue=8):
+        # put() blocks once max_queue grids are waiting (back-pressure instead of unbounded memory)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+        self.error = None
+
+        self.workers = []
+        for _ in range(max(num_workers, 1)):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        atexit.register(self.close)
+
+    def save_images(self, images, size, image_path):
+        self.raise_error()
+
+        if self.closed :
+            return save_images(images, size, image_path)
+
+        self.queue.put((images, size, image_path))
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None :
+                    return
+
+                images, size, image_path = item
+                if not save_images(images, size, image_path) :
+                    raise IOError(" [!] Failed to write {}".format(image_path))
+
+            except Exception as e:
+                # only the first failure is kept, the worker goes on with the queue
+                if self.error is None :
+                    self.error = e
+
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        error, self.error = self.error, None
+        if error is not None :
+            raise error
+
+    def flush(self):
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        if self.closed :
+            return
+
+        self.closed = True
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+        self.raise_error()
+
+##################################################################################
+# Data parallel
+##################################################################################
+
+def init_data_parallel():
+    # optional dependency, only imported for --data_parallel
+    try:
+        import horovod.tensorflow as hvd
+    except ImportError:
+        raise ImportError("--data_parallel needs horovod : pip install horovod, then launch with "
+                          "horovodrun -np N python main.py --data_parallel True ...")
+
+    hvd.init()
+
+    return hvd
+
+def data_parallel_barrier(hvd):
+    # every rank blocks here until all arrive, in a cpu-only session so no gpu is touched
+    with tf.Graph().as_default():
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            sess.run(hvd.allreduce(tf.constant(0.0), name='barrier'))
+
+def data_parallel_session_config(config, hvd, device='auto'):
+    # one replica per local gpu, or an even share of the cores per cpu replica
+    # decided from --device and the environment : probing the gpus here would map all of them in every rank
+    if gpus_expected(device) :
+        config.gpu_options.visible_device_list = str(hvd.local_rank())
+        config.gpu_options.allow_growth = True
+    else :
+        config.intra_op_parallelism_threads = max(available_cores() // hvd.local_size(), 1)
+        config.inter_op_parallelism_threads = 2
+
+    return config
+
+##################################################################################
+# Throughput
+##################################################################################
+
+class ThroughputLogger:
+    """ Per step timings appended to throughput.jsonl, window means written as summaries every print_freq """
+
+    def __init__(self, log_dir, images_per_step, writer=None):
+        self.images_per_step = images_per_step
+        self.writer = writer
+        self.file = open(os.path.join(check_folder(log_dir), 'throughput.jsonl'), 'a')
+        self.window = []
+
+    def log(self, step, wall_time, data_time=None, d_time=None, g_time=None, d_loss=None, g_loss=None):
+        record = {'step': step, 'wall_time': wall_time, 'images_per_sec': self.images_per_step / max(wall_time, 1e-12)}
+
+        # timings a mode can not measure are left out, not written as 0
+        for key, value in [('data_time', data_time), ('d_time', d_time), ('g_time', g_time)]:
+            if value is not None :
+                record[key] = float(value)
+
+        # losses are only fetched every print_freq steps
+        if d_loss is not None :
+            record['d_loss'] = float(d_loss)
+            record['g_loss'] = float(g_loss)
+
+        self.file.write(json.dumps(record) + '\n')
+        self.window.append(record)
+
+    def summarize(self, step):
+        if not self.window :
+            return {}
+
+        keys = ['wall_time', 'data_time', 'd_time', 'g_time', 'images_per_sec']
+        means = {key: float(np.mean([record[key] for record in self.window]))
+                 for key in keys if all(key in record for record in self.window)}
+        if 'data_time' in means :
+            means['data_wait_ratio'] = means['data_time'] / max(means['wall_time'], 1e-12)
+
+        if self.writer is not None :
+            summary = tf.Summary(value=[tf.Summary.Value(tag='throughput/' + key, simple_value=value)
+                                        for key, value in means.items()])
+            self.writer.add_summary(summary, step)
+
+        self.file.flush()
+        self.window = []
+
+        return means
+
+    def close(self):
+        self.file.close()
+
+##################################################################################
+# Tracing
+##################################################################################
+
+def parse_steps(steps):
+    # '100-102,500' -> {100, 101, 102, 500}
+    result = set()
+    for item in steps.split(','):
+        item = item.strip()
+        if not item :
+            continue
+
+        if '-' in item :
+            start, end = item.split('-')
+            result.update(range(int(start), int(end) + 1))
+        else :
+            result.add(int(item))
+
+    return result
+
+def is_loop_scope(part):
+    # name scopes added by the in-graph training loop of --loop_steps : train_loop/while/while/...
+    return part == 'train_loop' or re.match(r'^while(_\d+)?$', part) is not None
+
+def scope_times(run_metadata, depth=2):
+    """
+    Sum of op compute time (micros) per variable_scope prefix, e.g. discriminator/conv1
+    ops of the --loop_steps loop are counted under the model scope they run, not under train_loop/while
+    """
+    times = {}
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            parts = [part for part in node_stats.node_name.split(':')[0].split('/')[:-1] if not is_loop_scope(part)]
+
+            # backward ops keep their forward scope : gradients/discriminator/conv1
+            prefix = parts[:1] if parts and parts[0].startswith('gradients') else []
+            scope = '/'.join(prefix + parts[len(prefix):len(prefix) + depth]) or node_stats.node_name
+            times[scope] = times.get(scope, 0) + node_stats.op_end_rel_micros - node_stats.op_start_rel_micros
+
+    return sorted(times.items(), key=lambda x: -x[1])
+
+def write_trace(run_metadata, path, depth=2, top=10):
+    # chrome://tracing json, every event carries its full scoped op name in args.name
+    trace = timeline.Timeline(run_metadata.step_stats)
+    with open(path, 'w') as f:
+        f.write(trace.generate_chrome_trace_format(show_memory=True))
+
+    times = scope_times(run_metadata, depth)
+    with open(path.replace('.json', '_scopes.json'), 'w') as f:
+        json.dump([{'scope': scope, 'micros': micros} for scope, micros in times], f, indent=2)
+
+    print(" [*] Trace {}".format(path))
+    for scope, micros in times[:top]:
+        print("#   {:<48s} {:10.3f} ms".format(scope, micros / 1000.0))
+
+##################################################################################
+# Checkpoint
+##################################################################################
+
+class AsyncCheckpointer:
+    """ Copy variables into in-graph shadow snapshots, then write the snapshot on a background thread """
+
+    def __init__(self, sess, var_list, checkpoint_dir, model_name, keep_last=5, keep_every=0,
+                 write_meta_graph=True, scope='snapshot'):
+        self.sess = sess
+        self.checkpoint_dir = check_folder(checkpoint_dir)
+        self.checkpoint_prefix = os.path.join(checkpoint_dir, model_name + '.model')
+
+        # keep the newest keep_last checkpoints plus every step divisible by keep_every (0 = off)
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.write_meta_graph = write_meta_graph
+
+        shadows = {}
+        with tf.name_scope(scope):
+            for var in var_list:
+                shadows[var.op.name] = tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False,
+                                                   collections=[tf.GraphKeys.LOCAL_VARIABLES], name=var.op.name)
+
+        var_dict = {var.op.name: var for var in var_list}
+        self.snapshot_op = tf.group(*[shadows[name].assign(var) for name, var in var_dict.items()])
+
+        # the shadows are written under the original names, so a plain tf.train.Saver restores them
+        self.saver = tf.train.Saver(var_list=shadows, max_to_keep=None)
+        self.sess.run(tf.variables_initializer(list(shadows.values())))
+
+        ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+        self.checkpoints = list(ckpt.all_model_checkpoint_paths) if ckpt else []
+
+        self.thread = None
+        self.error = None
+
+    def save(self, step):
+        # one snapshot in flight at a time, the next save waits for the previous write and raises its failure
+        self.wait()
+        self.sess.run(self.snapshot_op)
+
+        self.thread = threading.Thread(target=self._write, args=(step,))
+        self.thread.start()
+
+    def _write(self, step):
+        # a failed write (disk full, permissions, retention) is raised by the next save or wait
+        try:
+            self._save(step)
+        except Exception as e:
+            self.error = e
+
+    def _save(self, step):
+        path = self.saver.save(self.sess, self.checkpoint_prefix, global_step=step,
+                               write_meta_graph=self.write_meta_graph, write_state=False)
+
+        if path in self.checkpoints :
+            self.checkpoints.remove(path)
+        self.checkpoints.append(path)
+        self._apply_retention()
+
+        tf.train.update_checkpoint_state(self.checkpoint_dir, path, all_model_checkpoint_paths=self.checkpoints)
+
+    def _apply_retention(self):
+        if self.keep_last <= 0 :
+            return
+
+        recent = self.checkpoints[-self.keep_last:]
+        kept = []
+        for path in self.checkpoints:
+            step = int(path.split('-')[-1])
+            if path in recent or (self.keep_every > 0 and step % self.keep_every == 0) :
+                kept.append(path)
+            else :
+                tf.train.remove_checkpoint(path)
+
+        self.checkpoints = kept
+
+    def wait(self):
+        if self.thread is not None :
+            self.thread.join()
+            self.thread = None
+
+        error, self.error = self.error, None
+        if error is not None :
+            raise error
+
+def generator_variables(scope='generator'):
+    # generator weights and batch-norm statistics, without the optimizer slots
+    return [var for var in tf.global_variables(scope) if 'Adam' not in var.op.name]
+
+##################################################################################
+# Export
+##################################################################################
+
+def fold_batch_norms(graph_def):
+    """ Fold inference-mode FusedBatchNorm nodes of a frozen graph into the preceding conv / deconv weights and bias """
+    folded = tf.GraphDef()
+    folded.CopyFrom(graph_def)
+
+    nodes = {node.name: node for node in folded.node}
+
+    consumers = {}
+    for node in folded.node:
+        for name in node.input:
+            consumers.setdefault(name.lstrip('^'), []).append(node)
+
+    def source(name):
+        node = nodes[name.split(':')[0].lstrip('^')]
+        while node.op == 'Identity':
+            node = nodes[node.input[0].split(':')[0].lstrip('^')]
+        return node
+
+    def value(name):
+        return tensor_util.MakeNdarray(source(name).attr['value'].tensor)
+
+    batch_norms = [node for node in folded.node
+                   if node.op in ['FusedBatchNorm', 'FusedBatchNormV2', 'FusedBatchNormV3'] and not node.attr['is_training'].b]
+
+    count = 0
+    for node in batch_norms:
+        x = nodes[node.input[0].split(':')[0]]
+
+        bias = 0.0
+        if x.op == 'BiasAdd' :
+            bias = value(x.input[1])
+            conv = nodes[x.input[0].split(':')[0]]
+        else :
+            conv = x
+
+        # Conv2D : filter [kh, kw, in, out], Conv2DBackpropInput (deconv) : filter [kh, kw, out, in]
+        if conv.op not in ['Conv2D', 'Conv2DBackpropInput'] :
+            continue
+
+        w_node = source(conv.input[1])
+        if w_node.op != 'Const' or len(consumers.get(conv.input[1].split(':')[0], [])) != 1 :
+            # spectral-normed or shared weights are computed at run time, leave them alone
+            continue
+
+        # the batch norm must be the only consumer of the conv (and bias) output, the fold rescales it for everyone
+        if len(consumers.get(conv.name, [])) != 1 or (x is not conv and len(consumers.get(x.name, [])) != 1) :
+            continue
+
+        # only the normalized output may be used, the batch statistics outputs have no folded equivalent
+        if any('{}:{}'.format(node.name, i) in consumers for i in range(1, 6)) :
+            continue
+
+        gamma, beta, mean, var = [value(name) for name in node.input[1:5]]
+        scale = gamma / np.sqrt(var + node.attr['epsilon'].f)
+
+        w = tensor_util.MakeNdarray(w_node.attr['value'].tensor)
+        if conv.op == 'Conv2D' :
+            w = w * scale
+        else :
+            w = w * scale.reshape([1, 1, -1, 1])
+        w_node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(w.astype(np.float32)))
+
+        bias_node = folded.node.add()
+        bias_node.op = 'Const'
+        bias_node.name = node.name + '/folded_bias'
+        bias_node.attr['dtype'].type = tf.float32.as_datatype_enum
+        bias_node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(((bias - mean) * scale + beta).astype(np.float32)))
+
+        # the batch norm node becomes the BiasAdd, so its consumers are untouched
+        data_format = node.attr['data_format'].s or b'NHWC'
+        node.op = 'BiasAdd'
+        del node.input[:]
+        node.input.extend([conv.name, bias_node.name])
+        node.attr.clear()
+        node.attr['T'].type = tf.float32.as_datatype_enum
+        node.attr['data_format'].s = data_format
+
+        count += 1
+
+    print(" [*] Folded {} batch norms".format(count))
+
+    return folded
+
+def run_frozen_graph(graph_def, feed_dict, output_name):
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        with tf.Session(graph=graph) as sess:
+            return sess.run(output_name, feed_dict=feed_dict)
+
+def orthogonal_regularizer(scale) :
+    """ Defining the Orthogonal regularizer and return the function at last to be used in Conv layer as kernel regularizer"""
+
+    def ortho_reg(w) :
+        """ Reshaping the matrxi in to 2D tensor for enforcing orthogonality"""
+        _, _, _, c = w.get_shape().as_list()
+
+        w = tf.reshape(w, [-1, c])
+
+        """ Declaring a Identity Tensor of appropriate size"""
+        identity = tf.eye(c)
+
+        """ Regularizer Wt*W - I """
+        w_transpose = tf.transpose(w)
+        w_mul = tf.matmul(w_transpose, w)
+        reg = tf.subtract(w_mul, identity)
+
+        """Calculating the Loss Obtained"""
+        ortho_loss = tf.nn.l2_loss(reg)
+
+        return scale * ortho_loss
+
+    return ortho_reg
+
+def orthogonal_regularizer_fully(scale) :
+    """ Defining the Orthogonal regularizer and return the function at last to be used in Fully Connected Layer """
+
+    def ortho_reg_fully(w) :
+        """ Reshaping the matrix in to 2D tensor for enforcing orthogonality"""
+        _, c = w.get_shape().as_list()
+
+        """Declaring a Identity Tensor of appropriate size"""
+        identity = tf.eye(c)
+        w_transpose = tf.transpose(w)
+        w_mul = tf.matmul(w_transpose, w)
+        reg = tf.subtract(w_mul, identity)
+
+        """ Calculating the Loss """
+        ortho_loss = tf.nn.l2_loss(reg)
+
+        return scale * ortho_loss
+
+    return ortho_reg_fully
+
+def tf_rgb_to_gray(x) :
+    x = (x + 1.0) * 0.5
+    x = tf.image.rgb_to_grayscale(x)
+
+    x = (x * 2) - 1.0
+
+    return x
+
+def RGB2LAB(srgb):
+    srgb = inverse_transform(srgb)
+
+    lab = rgb_to_lab(srgb)
+    l, a, b = preprocess_lab(lab)
+
+    l = tf.expand_dims(l, axis=-1)
+    a = tf.expand_dims(a, axis=-1)
+    b = tf.expand_dims(b, axis=-1)
+
+    x = tf.concat([l, a, b], axis=-1)
+
+    return x
+
+def LAB2RGB(lab) :
+    lab = inverse_transform(lab)
+
+    rgb = lab_to_rgb(lab)
+    rgb = tf.clip_by_value(rgb, 0, 1)
+
+    # r, g, b = tf.unstack(rgb, axis=-1)
+    # rgb = tf.concat([r,g,b], axis=-1)
+
+    x = (rgb * 2) - 1.0
+
+    return x
+
+def rgb_to_lab(srgb):
+    with tf.name_scope('rgb_to_lab'):
+        srgb_pixels = tf.reshape(srgb, [-1, 3])
+        with tf.name_scope('srgb_to_xyz'):
+            linear_mask = tf.cast(srgb_pixels <= 0.04045, dtype=tf.float32)
+            exponential_mask = tf.cast(srgb_pixels > 0.04045, dtype=tf.float32)
+            rgb_pixels = (srgb_pixels / 12.92 * linear_mask) + (((srgb_pixels + 0.055) / 1.055) ** 2.4) * exponential_mask
+            rgb_to_xyz = tf.constant([
+                #    X        Y          Z
+                [0.412453, 0.212671, 0.019334], # R
+                [0.357580, 0.715160, 0.119193], # G
+                [0.180423, 0.072169, 0.950227], # B
+            ])
+            xyz_pixels = tf.matmul(rgb_pixels, rgb_to_xyz)
+
+        with tf.name_scope('xyz_to_cielab'):
+            # convert to fx = f(X/Xn), fy = f(Y/Yn), fz = f(Z/Zn)
+
+            # normalize for D65 white point
+            xyz_normalized_pixels = tf.multiply(xyz_pixels, [1/0.950456, 1.0, 1/1.088754])
+
+            epsilon = 6/29
+            linear_mask = tf.cast(xyz_normalized_pixels <= (epsilon**3), dtype=tf.float32)
+            exponential_mask = tf.cast(xyz_normalized_pixels > (epsilon**3), dtype=tf.float32)
+            fxfyfz_pixels = (xyz_normalized_pixels / (3 * epsilon**2) + 4/29) * linear_mask + (xyz_normalized_pixels ** (1/3)) * exponential_mask
+
+            # convert to lab
+            fxfyfz_to_lab = tf.constant([
+                #  l       a       b
+                [  0.0,  500.0,    0.0], # fx
+                [116.0, -500.0,  200.0], # fy
+                [  0.0,    0.0, -200.0], # fz
+            ])
+            lab_pixels = tf.matmul(fxfyfz_pixels, fxfyfz_to_lab) + tf.constant([-16.0, 0.0, 0.0])
+
+        return tf.reshape(lab_pixels, tf.shape(srgb))
+
+
+def lab_to_rgb(lab):
+    with tf.name_scope('lab_to_rgb'):
+        lab_pixels = tf.reshape(lab, [-1, 3])
+        with tf.name_scope('cielab_to_xyz'):
+            # convert to fxfyfz
+            lab_to_fxfyfz = tf.constant([
+                #   fx      fy        fz
+                [1/116.0, 1/116.0,  1/116.0], # l
+                [1/500.0,     0.0,      0.0], # a
+                [    0.0,     0.0, -1/200.0], # b
+            ])
+            fxfyfz_pixels = tf.matmul(lab_pixels + tf.constant([16.0, 0.0, 0.0]), lab_to_fxfyfz)
+
+            # convert to xyz
+            epsilon = 6/29
+            linear_mask = tf.cast(fxfyfz_pixels <= epsilon, dtype=tf.float32)
+            exponential_mask = tf.cast(fxfyfz_pixels > epsilon, dtype=tf.float32)
+            xyz_pixels = (3 * epsilon**2 * (fxfyfz_pixels - 4/29)) * linear_mask + (fxfyfz_pixels ** 3) * exponential_mask
+
+            # denormalize for D65 white point
+            xyz_pixels = tf.multiply(xyz_pixels, [0.950456, 1.0, 1.088754])
+
+        with tf.name_scope('xyz_to_srgb'):
+            xyz_to_rgb = tf.constant([
+                #     r           g          b
+                [ 3.2404542, -0.9692660,  0.0556434], # x
+                [-1.5371385,  1.8760108, -0.2040259], # y
+                [-0.4985314,  0.0415560,  1.0572252], # z
+            ])
+            rgb_pixels = tf.matmul(xyz_pixels, xyz_to_rgb)
+            # avoid a slightly negative number messing up the conversion
+            rgb_pixels = tf.clip_by_value(rgb_pixels, 0.0, 1.0)
+            linear_mask = tf.cast(rgb_pixels <= 0.0031308, dtype=tf.float32)
+            exponential_mask = tf.cast(rgb_pixels > 0.0031308, dtype=tf.float32)
+            srgb_pixels = (rgb_pixels * 12.92 * linear_mask) + ((rgb_pixels ** (1/2.4) * 1.055) - 0.055) * exponential_mask
+
+        return tf.reshape(srgb_pixels, tf.shape(lab))
+
+def preprocess_lab(lab):
+    with tf.name_scope('preprocess_lab'):
+        L_chan, a_chan, b_chan = tf.unstack(lab, axis=-1)
+        # L_chan: black and white with input range [0, 100]
+        # a_chan/b_chan: color channels with input range [-128, 127]
+        # [0, 100] => [-1, 1],  ~[-128, 127] => [-1, 1]
+
+        L_chan = L_chan * 255.0 / 100.0
+        a_chan = a_chan + 128
+        b_chan = b_chan + 128
+
+        L_chan /= 255.0
+        a_chan /= 255.0
+        b_chan /= 255.0
+
+        L_chan = (L_chan - 0.5) / 0.5
+        a_chan = (a_chan - 0.5) / 0.5
+        b_chan = (b_chan - 0.5) / 0.5
+
+        return [L_chan, a_chan, b_chan]
+
+def show_all_variables():
+    from tensorflow.contrib import slim  # loaded on first use
+
+    model_vars = tf.trainable_variables()
+    slim.model_analyzer.analyze_vars(model_vars, print_info=True)
+
+def show_memory_report(path=None, depth=2, graph=None):
+    """
+    Static per-scope memory estimate from the graph shapes, one row per variable_scope
+    reused scopes (discriminator_1, the inference generator_2, ...) are counted under the scope that owns the variables
+    activation : sum of the forward op outputs in the scope (all of them stay alive until the backward pass)
+    largest_op : largest single op output in the scope, a lower bound for inference, not a peak of the allocator
+    both are split into train and inference (batch norm on moving statistics) graphs of the scope
+    param / slot : variables of the scope and their optimizer slots
+    """
+    graph = graph or tf.get_default_graph()
+    report = {}
+
+    def scope_of(name):
+        parts = name.split('/')[:depth]
+        parts[0] = re.sub(r'_\d+$', '', parts[0])
+        return '/'.join(parts)
+
+    def entry(scope):
+        return report.setdefault(scope, {'train_activation_bytes': 0, 'train_largest_op_bytes': 0,
+                                         'inference_activation_bytes': 0, 'inference_largest_op_bytes': 0,
+                                         'param_bytes': 0, 'slot_bytes': 0})
+
+    def num_bytes(shape, dtype):
+        if not shape.is_fully_defined() :
+            return 0
+        return int(np.prod(shape.as_list())) * dtype.base_dtype.size
+
+    for var in tf.global_variables():
+        name = var.op.name
+        if '/Adam' in name :
+            # discriminator/conv1/conv2d/kernel/Adam_1 belongs to discriminator/conv1
+            entry(scope_of(name))['slot_bytes'] += num_bytes(var.shape, var.dtype)
+        elif '/' in name :
+            entry(scope_of(name))['param_bytes'] += num_bytes(var.shape, var.dtype)
+
+    # a top-level name scope is an inference graph when its batch norms only read the moving statistics
+    batch_stats = {}
+    for op in graph.get_operations():
+        top = op.name.split('/')[0]
+        if op.type.startswith('FusedBatchNorm') :
+            batch_stats[top] = batch_stats.get(top, False) or op.get_attr('is_training')
+        elif '/moments/' in op.name :
+            batch_stats[top] = True
+
+    skip_ops = ['Const', 'VariableV2', 'VarHandleOp', 'ReadVariableOp', 'Identity', 'Assign', 'NoOp', 'Shape']
+    for op in graph.get_operations():
+        if op.type in skip_ops or op.name.startswith('gradients') or '/Adam' in op.name or '/' not in op.name :
+            continue
+
+        # the --loop_steps body repeats the forward of the single step graph, counted once
+        if op.name.startswith('train_loop/') :
+            continue
+
+        mode = 'inference' if batch_stats.get(op.name.split('/')[0]) is False else 'train'
+
+        for output in op.outputs:
+            if not output.dtype.is_floating :
+                continue
+
+            size = num_bytes(output.shape, output.dtype)
+            scope = entry(scope_of(op.name))
+            scope[mode + '_activation_bytes'] += size
+            scope[mode + '_largest_op_bytes'] = max(scope[mode + '_largest_op_bytes'], size)
+
+    report = {scope: value for scope, value in report.items() if any(value.values())}
+
+    def mb(x):
+        return x / (1024.0 * 1024.0)
+
+    print("##### Memory (MB) #####")
+    print("# {:<32s} {:>12s} {:>12s} {:>12s} {:>12s} {:>10s} {:>10s}".format(
+        'scope', 'train act', 'train op', 'infer act', 'infer op', 'param', 'slot'))
+    for scope, value in sorted(report.items(), key=lambda x: -x[1]['train_activation_bytes']):
+        print("# {:<32s} {:12.2f} {:12.2f} {:12.2f} {:12.2f} {:10.2f} {:10.2f}".format(
+            scope, mb(value['train_activation_bytes']), mb(value['train_largest_op_bytes']),
+            mb(value['inference_activation_bytes']), mb(value['inference_largest_op_bytes']),
+            mb(value['param_bytes']), mb(value['slot_bytes'])))
+    print()
+
+    if path :
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    return report
+
+def check_folder(log_dir):
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return log_dir
+
+def str2bool(x):
+    return x.lower() in ('true')
+
+def pytorch_xavier_weight_factor(gain=0.02, uniform=False) :
+
+    if uniform :
+        factor = gain * gain
+        mode = 'FAN_AVG'
+    else :
+        factor = (gain * gain) / 1.3
+        mode = 'FAN_AVG'
+
+    return factor, mode, uniform
+
+def pytorch_kaiming_weight_factor(a=0.0, activation_function='relu', uniform=False) :
+
+    if activation_function == 'relu' :
+        gain = np.sqrt(2.0)
+    elif activation_function == 'leaky_relu' :
+        gain = np.sqrt(2.0 / (1 + a ** 2))
+    elif activation_function =='tanh' :
+        gain = 5.0 / 3
+    else :
+        gain = 1.0
+
+    if uniform :
+        factor = gain * gain
+        mode = 'FAN_IN'
+    else :
+        factor = (gain * gain) / 1.3
+        mode = 'FAN_IN'
+
+    return factor, mode, uniform
\ No newline at end of file